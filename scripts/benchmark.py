@@ -0,0 +1,207 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# What the helper scripts need at startup versus the full renderer
+STARTUP_CASES = {
+    "python": "pass",
+    "song (index/README tools)": "import song; song.sort_songs([])",
+    "compile (import only)": "import compile",
+    "compile (fonts + footer)": "import compile; compile.register_fonts(); compile.footer_images()",
+}
+
+
+def time_startup(code: str, repeats: int):
+    '''Wall time in milliseconds of a fresh interpreter running the code'''
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(SCRIPTS_DIR),
+                       env={**os.environ, "PYTHONPATH": SCRIPTS_DIR}, capture_output=True, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def startup(args):
+    results = {}
+    for name, code in STARTUP_CASES.items():
+        samples = time_startup(code, args.repeats)
+        results[name] = {"median_ms": statistics.median(samples), "min_ms": min(samples)}
+        print(f"{name}: {results[name]['median_ms']:.1f} ms (min {results[name]['min_ms']:.1f} ms)")
+    return results
+
+
+def load_corpus():
+    '''Raw text of all .fasta files in songs/'''
+    songs_dir = os.path.join(os.path.dirname(SCRIPTS_DIR), "songs")
+    texts = []
+    for filename in sorted(os.listdir(songs_dir)):
+        if filename.endswith(".fasta"):
+            with open(os.path.join(songs_dir, filename), "r", encoding="utf-8") as file:
+                texts.append(file.read())
+    return "\n".join(texts)
+
+
+def memory(args):
+    '''Memory held by the parsed songs of a merged catalogue of the given size'''
+    sys.path.insert(0, SCRIPTS_DIR)
+    from song import Song
+
+    corpus = load_corpus()
+    tracemalloc.start()
+    songs = []
+    while len(songs) < args.songs:
+        songs.extend(Song.iter_from_fasta(corpus))
+    del songs[args.songs:]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results = {"songs": len(songs), "total_bytes": current, "peak_bytes": peak, "bytes_per_song": current / len(songs)}
+    print(f"{len(songs)} songs: {current / 2**20:.1f} MiB, {results['bytes_per_song'] / 1024:.2f} KiB per song (peak {peak / 2**20:.1f} MiB)")
+    return results
+
+
+def synthetic_songs(size: int):
+    '''A songbook of the given size made of copies of the corpus songs, the
+    copies get numbered titles so that every song is distinct'''
+    from song import Song
+
+    corpus = list(Song.iter_from_fasta(load_corpus()))
+    songs = []
+    for i in range(size):
+        song = corpus[i % len(corpus)]
+        copy = i // len(corpus)
+        songs.append(song if copy == 0 else Song(f"{song.title} ({copy})", song.author, song.paragraphs))
+    return songs
+
+
+def run_stages(size: int, impose_book: bool):
+    '''Times every stage of compile.py on a synthetic songbook. Runs in a fresh
+    process, so the peak RSS after each stage belongs to this songbook only.'''
+    os.chdir(os.path.dirname(SCRIPTS_DIR))
+    sys.path.insert(0, SCRIPTS_DIR)
+    import compile
+    from song import Song
+    from impose_a5_to_a4 import impose
+
+    compile.register_fonts()
+    compile.footer_images()
+    text = "".join(repr(song) for song in synthetic_songs(size))
+
+    stages = {}
+    def stage(name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        stages[name] = {"seconds": time.perf_counter() - start,
+                        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+        return result
+
+    songs = stage("parse", lambda: list(Song.iter_from_fasta(text)))
+    del text
+    blocks = stage("parse_song_lyrics", lambda: [(compile.parse_song_lyrics(song), compile.compute_title_params(song)) for song in songs])
+    placements = stage("compute_block_placement", lambda: [compile.compute_block_placement(pars, title) for pars, title in blocks])
+    pages = stage("schedule_pages", compile.schedule_pages, placements, compile.config.max_reorder_distance)
+    pdf = io.BytesIO()
+    stage("render", compile.PageTarget(pdf).render, pages)
+    pdf_bytes = len(pdf.getvalue())
+    if impose_book:
+        pdf.seek(0)
+        stage("impose", impose, pdf, io.BytesIO())
+    return {"songs": size, "pages": len(pages), "pdf_bytes": pdf_bytes, "stages": stages}
+
+
+def stages(args):
+    results = []
+    for size in args.sizes:
+        # Spawned (not forked) so the peak RSS does not include earlier runs
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(run_stages, size, not args.no_impose).result()
+        results.append(result)
+        timings = ", ".join(f"{name} {stage['seconds']:.2f} s" for name, stage in result["stages"].items())
+        peak = max(stage["peak_rss_bytes"] for stage in result["stages"].values())
+        print(f"{size} songs, {result['pages']} pages: {timings} (peak RSS {peak / 2**20:.0f} MiB)")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = {result["songs"]: result for result in json.load(file)["stages"]}
+        regressions = compare_stages(baseline, results, args.tolerance)
+        if regressions:
+            print("Slower than the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            # Results are still written before failing
+            args.failed = True
+    return results
+
+
+def compare_stages(baseline: dict, results: list, tolerance: float):
+    '''Stages which took more than tolerance times their baseline time'''
+    regressions = []
+    for result in results:
+        old = baseline.get(result["songs"])
+        if old is None:
+            continue
+        for name, stage in result["stages"].items():
+            old_stage = old["stages"].get(name)
+            if old_stage is not None and stage["seconds"] > tolerance * old_stage["seconds"]:
+                regressions.append(f"{result['songs']} songs, {name}: {stage['seconds']:.2f} s vs {old_stage['seconds']:.2f} s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the songbook tools."
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    startup_parser = subparsers.add_parser("startup", help="Import time of the modules used by the scripts")
+    startup_parser.add_argument('--repeats', type=int, default=5, help="Runs per case (default: 5)")
+    startup_parser.set_defaults(run=startup)
+
+    memory_parser = subparsers.add_parser("memory", help="Memory footprint of parsed songs")
+    memory_parser.add_argument('--songs', type=int, default=20000, help="Size of the merged catalogue (default: 20000)")
+    memory_parser.set_defaults(run=memory)
+
+    stages_parser = subparsers.add_parser("stages", help="Time of every compile stage on synthetic songbooks")
+    stages_parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[100, 1000, 10000],
+        help="Songbook sizes in songs (default: 100 1000 10000, up to 100000 works but takes a while)"
+    )
+    stages_parser.add_argument('--no-impose', action='store_true', help="Skip imposing the A4 booklet")
+    stages_parser.add_argument('--baseline', help="Earlier --json output to compare against")
+    stages_parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=1.25,
+        help="Fail when a stage is this many times slower than the baseline (default: 1.25)"
+    )
+    stages_parser.set_defaults(run=stages)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--json', help="Write the results to this file as JSON")
+
+    args = parser.parse_args()
+    args.failed = False
+    results = args.run(args)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({args.benchmark: results}, file, indent=2)
+    if args.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+from typing import List
+
+from song import Song, sort_songs
+from song_loader import load_songs
+
+BUNDLE_VERSION = 1
+
+
+def song_data(song: Song) -> dict:
+    '''A song parsed for the browser: paragraphs with a chorus flag and
+    [lyrics, chords] line pairs'''
+    return {"title": song.title, "author": song.author,
+            "paragraphs": [{"chorus": paragraph.type == "chorus",
+                            "lines": [list(pair) for pair in zip(paragraph.lyrics_lines, paragraph.chords_lines)]}
+                           for paragraph in song.paragraphs]}
+
+
+def encode(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def split_chunks(songs: List[dict], chunk_size: int) -> List[List[dict]]:
+    '''Consecutive songs (in book order) grouped into chunks of about
+    chunk_size bytes of JSON, so scrolling loads the chunks one by one'''
+    chunks, chunk, size = [], [], 0
+    for song in songs:
+        song_size = len(encode(song))
+        if chunk and size + song_size > chunk_size:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(song)
+        size += song_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def build_bundle(songs: List[Song], output_dir: str, chunk_size: int) -> dict:
+    '''Writes the chunks and returns the table of contents.
+
+    Chunks are gzipped JSON lists of songs named after the hash of their
+    content, so a changed chunk gets a new URL and the others stay cached.
+    The table of contents lists every song as [title, author, chunk] (the
+    songs of a chunk are in toc order) and every chunk with its file, hash
+    and song count, it is the only file needed for the first paint.'''
+    sort_songs(songs)
+    chunks = split_chunks([song_data(song) for song in songs], chunk_size)
+    toc = {"version": BUNDLE_VERSION, "chunks": [], "songs": []}
+    written = set()
+    for chunk_id, chunk in enumerate(chunks):
+        # mtime=0 keeps the compressed bytes (and the hash) reproducible
+        data = gzip.compress(encode(chunk), compresslevel=9, mtime=0)
+        digest = hashlib.sha256(data).hexdigest()
+        filename = f"songs-{digest[:16]}.json.gz"
+        with open(os.path.join(output_dir, filename), "wb") as file:
+            file.write(data)
+        written.add(filename)
+        toc["chunks"].append({"file": filename, "hash": digest, "songs": len(chunk)})
+        toc["songs"].extend([song["title"], song["author"], chunk_id] for song in chunk)
+
+    # Chunks of earlier builds are not referenced any more
+    for path in glob.glob(os.path.join(output_dir, "songs-*.json.gz")):
+        if os.path.basename(path) not in written:
+            os.remove(path)
+    return toc
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the precompiled song bundle of the browser edition: a small table of contents and gzipped song chunks."
+    )
+    parser.add_argument('input_files', nargs='*', default=['songs/*.fasta'], help="Path to .fasta files (default: songs/*.fasta)")
+    parser.add_argument('-o', '--output', default='bundle', help="Output directory (default: bundle)")
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=32 * 1024,
+        help="Uncompressed size of a chunk in bytes (default: 32768)"
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    songs = load_songs(args.input_files)
+    toc = build_bundle(songs, args.output, args.chunk_size)
+    toc_path = os.path.join(args.output, "toc.json")
+    with open(toc_path, "wb") as file:
+        file.write(encode(toc))
+
+    compressed = sum(os.path.getsize(os.path.join(args.output, chunk["file"])) for chunk in toc["chunks"])
+    print(f"Bundled {len(toc['songs'])} songs into {len(toc['chunks'])} chunks ({compressed / 1024:.1f} KiB), "
+          f"{toc_path} is {os.path.getsize(toc_path) / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
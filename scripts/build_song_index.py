@@ -1,13 +1,16 @@
-import os
-from song import Song
-from compile import sort_songs
+import json
+from song_loader import load_song_files, report_duplicate_titles
 
-files = filter(lambda x: len(x) >= 6 and x[-6:] == ".fasta", os.listdir(os.getcwd()+"/songs"))
-result = ''
-result += '{'
-result += '"paths":'
-result += str(['songs/' + path for path in files]).replace("'", '"')
-result += '}'
+files = load_song_files(["songs/*.fasta"])
+paths = [path for path, _ in files]
 
-with open("song_manifest.json", "w") as file:
-    file.write(result)
\ No newline at end of file
+# Every song with the position of its text in the file, see song_store.py
+songs = []
+for path, file_songs in files:
+    for song in file_songs:
+        songs.append({"title": song.title, "author": song.author, "file": path, "line": song.source.line,
+                      "offset": song.source.offset, "length": song.source.length, "hash": song.content_hash()})
+report_duplicate_titles(song for _, file_songs in files for song in file_songs)
+
+with open("song_manifest.json", "w", encoding="utf-8") as file:
+    json.dump({"paths": paths, "songs": songs}, file, ensure_ascii=False, separators=(",", ":"))
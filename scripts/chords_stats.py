@@ -1,25 +1,238 @@
+import argparse
+import csv
+import json
 import os
+from array import array
+from collections import Counter
+from typing import List
+
 from song import Song
+from song_loader import load_song_files
+from transpose import chord_separator_regex, note_names, split_chord_token
+
+SONGS_PATTERN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "songs", "*.fasta")
+
+# Chords of a key as (steps above the tonic, minor), tonic first:
+# I ii iii IV V vi for major keys and i III iv v VI VII for minor ones
+major_key_chords = [(0, 0), (2, 1), (4, 1), (5, 0), (7, 0), (9, 1)]
+minor_key_chords = [(0, 1), (3, 0), (5, 1), (7, 1), (8, 0), (10, 0)]
+
+
+def key_name(tonic: int, minor: int) -> str:
+    '''Keys are named like chords: "G" is G major, "e" is E minor'''
+    return note_names[not minor][tonic]
+
+
+class ChordColumns:
+    '''All chord occurrences of a catalogue tokenised once into integer columns.
+
+    Chords are numbered in order of first appearance and spelled the same way
+    whatever the source wrote (A# and B, brackets), chord_ids holds the chord
+    of every occurrence and the occurrences of song i are
+    chord_ids[song_starts[i]:song_starts[i+1]]. roots and minor give the root
+    step and the quality of every chord, so per-song histograms and key
+    scores work on small integers only.'''
+    def __init__(self, names: List[str], roots: bytes, minor: bytes, chord_ids: array, song_starts: array, songs: List[Song]):
+        self.names = names
+        self.roots = roots
+        self.minor = minor
+        self.chord_ids = chord_ids
+        self.song_starts = song_starts
+        self.songs = songs
+
+    def from_songs(songs: List[Song]) -> 'ChordColumns':
+        # Source token or chord name -> chord id, None for invalid tokens
+        ids = {}
+        names, roots, minor = [], bytearray(), bytearray()
+
+        def chord_id(token: str):
+            parts = split_chord_token(token)
+            if parts is None:
+                return None
+            (step, upper), suffix = parts[1], parts[2]
+            name = note_names[upper][step] + suffix.rstrip(")")
+            if len(parts) > 3:
+                name += note_names[parts[3][1]][parts[3][0]] + parts[4].rstrip(")")
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+                roots.append(step)
+                # Lowercase roots are minor chords, "Am" is accepted too
+                minor.append(not upper or (suffix.startswith("m") and not suffix.startswith("maj")))
+            return ids[name]
+
+        chord_ids, song_starts = array("I"), array("I", [0])
+        for song in songs:
+            for paragraph in song.paragraphs:
+                for token in chord_separator_regex.split(paragraph.chords)[::2]:
+                    if token == "":
+                        continue
+                    if token not in ids:
+                        ids[token] = chord_id(token)
+                    if ids[token] is not None:
+                        chord_ids.append(ids[token])
+            song_starts.append(len(chord_ids))
+        return ChordColumns(names, bytes(roots), bytes(minor), chord_ids, song_starts, list(songs))
+
+    def song_chords(self, song_idx: int):
+        return self.chord_ids[self.song_starts[song_idx]:self.song_starts[song_idx + 1]]
+
+    def song_masks(self) -> List[int]:
+        '''Chords of every song as a bit set'''
+        masks = []
+        for i in range(len(self.songs)):
+            mask = 0
+            for chord in set(self.song_chords(i)):
+                mask |= 1 << chord
+            masks.append(mask)
+        return masks
+
+    def frequencies(self) -> List[dict]:
+        '''Occurrences and number of songs of every chord, most frequent first'''
+        occurrences = Counter(self.chord_ids)
+        songs = Counter(chord for i in range(len(self.songs)) for chord in set(self.song_chords(i)))
+        return [{"chord": self.names[chord], "occurrences": count, "songs": songs[chord]}
+                for chord, count in occurrences.most_common()]
 
-files = filter(lambda x: len(x) >= 6 and x[-6:] == ".fasta", os.listdir(os.getcwd()))
-
-total_songs = {}
-total_songs_with_chords = {}
-for path in files:
-    total_songs[path] = 0
-    total_songs_with_chords[path] = 0
-    with open(path, 'r') as f:
-        songs = Song.load_from_fasta(f.read())
-    for song in songs:
-        has_chords = False
-        total_songs[path] += 1
-        for paragraph in song.paragraphs:
-            if any([chord_line != "" for chord_line in paragraph.chords.split("\n")]):
-                total_songs_with_chords[path] += 1
+    def cooccurrence(self, top: int):
+        '''Number of songs with both chords, for the top most frequent chords'''
+        chords = [chord for chord, _ in Counter(self.chord_ids).most_common(top)]
+        index = {chord: i for i, chord in enumerate(chords)}
+        matrix = [[0] * len(chords) for _ in chords]
+        for song_idx in range(len(self.songs)):
+            present = [index[chord] for chord in set(self.song_chords(song_idx)) if chord in index]
+            for i in present:
+                row = matrix[i]
+                for j in present:
+                    row[j] += 1
+        return [self.names[chord] for chord in chords], matrix
+
+    def estimate_keys(self) -> List[dict]:
+        '''Key of every song with chords: the key whose chords cover most chord
+        occurrences, the tonic chord and the first and last chord count extra'''
+        keys = []
+        for song_idx, song in enumerate(self.songs):
+            chords = self.song_chords(song_idx)
+            if not chords:
+                continue
+            # Histogram over (root, quality) pairs
+            histogram = [0] * 24
+            for chord in chords:
+                histogram[2 * self.roots[chord] + self.minor[chord]] += 1
+            ends = [2 * self.roots[chord] + self.minor[chord] for chord in (chords[0], chords[-1])]
+            best = None
+            for tonic in range(12):
+                for minor, template in ((0, major_key_chords), (1, minor_key_chords)):
+                    members = [2 * ((tonic + step) % 12) + quality for step, quality in template]
+                    score = sum(histogram[member] for member in members) + histogram[members[0]] + 2 * ends.count(members[0])
+                    if best is None or score > best[0]:
+                        best = (score, tonic, minor, sum(histogram[member] for member in members))
+            _, tonic, minor, diatonic = best
+            keys.append({"title": song.title, "key": key_name(tonic, minor), "diatonic_share": round(diatonic / len(chords), 3)})
+        return keys
+
+    def minimum_vocabulary(self, coverage: float) -> List[dict]:
+        '''Chords to learn, in order, until coverage percent of the songs with
+        chords can be played.
+
+        Greedy: every step takes the chord completing the most songs, or when
+        no single chord completes one, the chord most missing songs are
+        closest to having. Exact minimum covers are NP-hard, this one is
+        computed in one pass over the bit sets per step.
+
+        Every step reports the songs playable so far and, as the first chords
+        rarely complete a song on their own, the share of all chord
+        occurrences covered so far.'''
+        masks = [mask for mask in self.song_masks() if mask]
+        needed = len(masks) * coverage / 100
+        occurrences = Counter(self.chord_ids)
+        vocabulary, steps, playable, covered = 0, [], 0, 0
+        while playable < needed:
+            completing, closest = Counter(), Counter()
+            for mask in masks:
+                missing = mask & ~vocabulary
+                if missing == 0:
+                    continue
+                count = missing.bit_count()
+                if count == 1:
+                    completing[missing.bit_length() - 1] += 1
+                chord = missing
+                while chord:
+                    bit = chord & -chord
+                    closest[bit.bit_length() - 1] += 1 / count
+                    chord ^= bit
+            if not closest:
                 break
+            chord = completing.most_common(1)[0][0] if completing else closest.most_common(1)[0][0]
+            vocabulary |= 1 << chord
+            playable = sum(1 for mask in masks if mask & ~vocabulary == 0)
+            covered += occurrences[chord]
+            steps.append({"chord": self.names[chord], "playable_songs": playable,
+                          "coverage": round(100 * playable / len(masks), 1),
+                          "occurrence_coverage": round(100 * covered / len(self.chord_ids), 1)})
+        return steps
+
+
+def file_summary(files) -> List[dict]:
+    '''Songs and songs with chords per file'''
+    summary = []
+    for path, songs in files:
+        with_chords = sum(1 for song in songs if any(paragraph.chords.strip() for paragraph in song.paragraphs))
+        summary.append({"file": os.path.basename(path), "songs": len(songs), "songs_with_chords": with_chords})
+    return summary
+
+
+def write_csv(path: str, rows: List[dict]):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Chord statistics of the songbook: frequencies, co-occurrence, keys and the chords to learn first."
+    )
+    parser.add_argument('input_files', nargs='*', default=[SONGS_PATTERN], help="Path to .fasta files (default: songs/*.fasta of the repository)")
+    parser.add_argument('-c', '--coverage', type=float, default=80, help="Percentage of songs the learning vocabulary must cover (default: 80)")
+    parser.add_argument('--top', type=int, default=15, help="Number of most frequent chords in the co-occurrence matrix (default: 15)")
+    parser.add_argument('--json', help="Write all results to this file as JSON")
+    parser.add_argument('--csv', help="Write all results as CSV files into this directory")
+    args = parser.parse_args()
+
+    files = load_song_files(args.input_files)
+    columns = ChordColumns.from_songs([song for _, songs in files for song in songs])
+    summary = file_summary(files)
+    frequencies = columns.frequencies()
+    cooccurrence_chords, cooccurrence = columns.cooccurrence(args.top)
+    keys = columns.estimate_keys()
+    vocabulary = columns.minimum_vocabulary(args.coverage)
+
+    for row in summary:
+        print(f"{row['file']}: {row['songs_with_chords']}/{row['songs']}")
+    print("---------------")
+    print(f"TOTAL: {sum(row['songs_with_chords'] for row in summary)}/{sum(row['songs'] for row in summary)}")
+    print()
+    print("Most frequent chords (occurrences): " + ", ".join(f"{row['chord']} ({row['occurrences']})" for row in frequencies[:args.top]))
+    print("Keys: " + ", ".join(f"{key} ({count})" for key, count in Counter(row["key"] for row in keys).most_common()))
+    print(f"Chords to learn for {args.coverage:g}% of the songs:")
+    for row in vocabulary:
+        print(f"  {row['chord']}: {row['occurrence_coverage']}% of all chords, {row['playable_songs']} songs playable ({row['coverage']}%)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"files": summary, "frequencies": frequencies,
+                       "cooccurrence": {"chords": cooccurrence_chords, "songs": cooccurrence},
+                       "keys": keys, "vocabulary": vocabulary}, file, ensure_ascii=False, indent=2)
+    if args.csv:
+        os.makedirs(args.csv, exist_ok=True)
+        write_csv(os.path.join(args.csv, "files.csv"), summary)
+        write_csv(os.path.join(args.csv, "frequencies.csv"), frequencies)
+        write_csv(os.path.join(args.csv, "cooccurrence.csv"),
+                  [{"chord": chord, **dict(zip(cooccurrence_chords, row))} for chord, row in zip(cooccurrence_chords, cooccurrence)])
+        write_csv(os.path.join(args.csv, "keys.csv"), keys)
+        write_csv(os.path.join(args.csv, "vocabulary.csv"), vocabulary)
 
-total_songs["---------------\nTOTAL"]=sum(total_songs.values())
-total_songs_with_chords["---------------\nTOTAL"]=sum(total_songs_with_chords.values())
 
-for path, chords, total in zip(total_songs.keys(), total_songs_with_chords.values(), total_songs.values()):
-    print(f"{path}: {chords}/{total}")
+if __name__ == "__main__":
+    main()
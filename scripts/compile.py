@@ -1,34 +1,42 @@
-from typing import List
-from math import ceil
+from typing import BinaryIO, List
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import argparse
-import locale
-import glob
+import functools
+import hashlib
+import json
 import os
+import pickle
 import re
 
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A5, A6
-from reportlab.pdfbase import pdfmetrics
+from reportlab.lib.pagesizes import A4, A5, A6
+from reportlab.pdfbase import pdfdoc, pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.graphics import renderPDF
-from svglib.svglib import svg2rlg
 
-from song import Song
-
-try:
-    locale.setlocale(locale.LC_COLLATE, 'pl_PL.UTF-8')
-except locale.Error:
-    print("Locale not supported on this system.")
-
-
-pdfmetrics.registerFont(TTFont('Garamond-Bold', 'EBGaramond-Bold.ttf'))
-pdfmetrics.registerFont(TTFont('NotoSerif', 'NotoSerif-Regular.ttf'))
-pdfmetrics.registerFont(TTFont('NotoSerif-SemiBold', 'NotoSerif-SemiBold.ttf'))
-pdfmetrics.registerFont(TTFont('NotoSerif-Light', 'NotoSerif-Light.ttf'))
-pdfmetrics.registerFont(TTFont('NotoSerif-LightItalic', 'NotoSerif-LightItalic.ttf'))
-pdfmetrics.registerFont(TTFont('CMU-Typewriter', 'cmunbto.ttf'))
+import profiling
+from song import Song, sort_songs
+from song_loader import load_songs, report_duplicate_titles
+from song_store import SongStore
+from layout_cache import LayoutCache, MemoryLayoutCache
+from text_metrics import string_width
+from transpose import transpose_songs
+
+@functools.cache
+def register_fonts():
+    '''Registers the TTF fonts on first use, so importing this module stays cheap'''
+    pdfmetrics.registerFont(TTFont('Garamond-Bold', 'EBGaramond-Bold.ttf'))
+    pdfmetrics.registerFont(TTFont('NotoSerif', 'NotoSerif-Regular.ttf'))
+    pdfmetrics.registerFont(TTFont('NotoSerif-SemiBold', 'NotoSerif-SemiBold.ttf'))
+    pdfmetrics.registerFont(TTFont('NotoSerif-Light', 'NotoSerif-Light.ttf'))
+    pdfmetrics.registerFont(TTFont('NotoSerif-LightItalic', 'NotoSerif-LightItalic.ttf'))
+    pdfmetrics.registerFont(TTFont('CMU-Typewriter', 'cmunbto.ttf'))
 
 class FontConfig:
+    __slots__ = ("name", "size")
+
     def __init__(self, font_name: str, font_size: float):
         self.name = font_name
         self.size = font_size
@@ -60,11 +68,35 @@ class CompilationConfig:
     par_gap = 12
 
     page_bind_offset = 20
+    # How many songs ahead a single-page song may be pulled to fill the page
+    # before a multi-page song
+    max_reorder_distance = 3
+    # Packing short songs together (compile.py --pack): how many consecutive
+    # songs may share pages and the space between songs on a page
+    pack_window = 8
+    song_gap = 30
     pagenos = False
 
 config = CompilationConfig()
 
+# Bump whenever the layout code changes in a way that invalidates cached layouts
+LAYOUT_VERSION = 2
+
+def config_fingerprint(config: CompilationConfig) -> str:
+    '''Hash of all config values, used to key cached layouts'''
+    values = {"layout_version": LAYOUT_VERSION}
+    for name in dir(config):
+        if name.startswith("_"):
+            continue
+        value = getattr(config, name)
+        if isinstance(value, FontConfig):
+            value = [value.name, value.size]
+        values[name] = value
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
 class TitleParams:
+    __slots__ = ("title", "author", "title_xoffset", "author_xoffset", "author_yoffset", "bottom_border")
+
     def __init__(self,
                  title: str,
                  author: str | None,
@@ -78,15 +110,38 @@ class TitleParams:
         self.author_yoffset = author_yoffset
         self.bottom_border = author_yoffset
 
+    def to_dict(self):
+        return {"title": self.title, "author": self.author, "title_xoffset": self.title_xoffset,
+                "author_xoffset": self.author_xoffset, "author_yoffset": self.author_yoffset}
+
+    def from_dict(data) -> 'TitleParams':
+        return TitleParams(**data)
+
+
+# [comments] in lyrics and chords, typeset with config.font_comment
+comment_regex = re.compile(r'\[([^\[\]]*)\]')
+
+
+def split_runs(line: str):
+    '''Splits a line into (is_comment, text) runs, comments lose their brackets'''
+    if "[" not in line:
+        return ((False, line),) if line else ()
+    return tuple((i % 2 == 1, part) for i, part in enumerate(comment_regex.split(line)) if part)
+
 
 class ParBlock:
+    __slots__ = ("lyrics_lines", "chords_lines", "lyrics_width", "chords_width",
+                 "total_width", "total_height", "x_offset", "page_break",
+                 "lyrics_runs", "chords_runs")
+
     def __init__(self,
                  lyrics_lines: List[str],
                  chords_lines: List[str],
                  lyrics_width: float,
                  chords_width: float,
                  total_height: float,
-                 x_offset: float):
+                 x_offset: float,
+                 page_break: bool | None = None):
         self.lyrics_lines = lyrics_lines
         self.chords_lines = chords_lines
         self.lyrics_width = lyrics_width
@@ -94,12 +149,27 @@ class ParBlock:
         self.total_width = lyrics_width+chords_width+config.chord_gap
         self.total_height = total_height
         self.x_offset = x_offset
+        self.page_break = page_break
+        # Lines tokenised once for drawing, see TextWriter
+        self.lyrics_runs = [split_runs(line) for line in lyrics_lines]
+        self.chords_runs = [split_runs(line) for line in chords_lines]
     
     def __repr__(self):
         return f"Paragraph: {' '.join(self.lyrics_lines)[:25]}...\nwidth: {self.total_width}, height: {self.total_height}"
 
+    def to_dict(self):
+        return {"lyrics_lines": self.lyrics_lines, "chords_lines": self.chords_lines,
+                "lyrics_width": self.lyrics_width, "chords_width": self.chords_width,
+                "total_height": self.total_height, "x_offset": self.x_offset,
+                "page_break": self.page_break}
+
+    def from_dict(data) -> 'ParBlock':
+        return ParBlock(**data)
+
 
 class BlockPlacement:
+    __slots__ = ("title_y", "pars_x", "pars_y_list", "chords_x_list", "title_params", "parblocks")
+
     def __init__(self,
                  title_y: float,
                  pars_x: float,
@@ -114,31 +184,44 @@ class BlockPlacement:
         self.title_params = title_params
         self.parblocks = parblocks
 
+    def to_dict(self):
+        return {"title_y": self.title_y, "pars_x": self.pars_x,
+                "pars_y_list": self.pars_y_list, "chords_x_list": self.chords_x_list,
+                "title_params": self.title_params.to_dict(),
+                "parblocks": [par.to_dict() for par in self.parblocks]}
+
+    def from_dict(data) -> 'BlockPlacement':
+        return BlockPlacement(data["title_y"], data["pars_x"], data["pars_y_list"], data["chords_x_list"],
+                              TitleParams.from_dict(data["title_params"]),
+                              [ParBlock.from_dict(par) for par in data["parblocks"]])
+
 
 def parse_song_lyrics(song: Song):
     '''Generates ParBlock objects with known dimensions'''
+    register_fonts()
     parblocks = [] 
     for paragraph in song.paragraphs:
-        lyrics_lines = paragraph.lyrics.split("\n")
+        lyrics_lines = paragraph.lyrics_lines
         chords_lines = performChordStrReplacements(paragraph.chords).split("\n")
         lyrics_width = 0
         chords_width = 0
         for line, chord in zip(lyrics_lines, chords_lines):
-            lyrics_width = max(lyrics_width, pdfmetrics.stringWidth(line, config.font_lyrics.name, config.font_lyrics.size))
-            chords_width = max(chords_width, pdfmetrics.stringWidth(chord, config.font_chords.name, config.font_chords.size))
+            lyrics_width = max(lyrics_width, string_width(line, config.font_lyrics.name, config.font_lyrics.size))
+            chords_width = max(chords_width, string_width(chord, config.font_chords.name, config.font_chords.size))
         
         x_offset = config.chorus_x_offset if paragraph.type == "chorus" else 0
         lyrics_width += x_offset
-        parblocks.append(ParBlock(lyrics_lines, chords_lines, lyrics_width, chords_width, len(lyrics_lines) * config.line_spacing, x_offset))
+        parblocks.append(ParBlock(lyrics_lines, chords_lines, lyrics_width, chords_width, paragraph.line_count * config.line_spacing, x_offset, paragraph.page_break))
     return parblocks
 
 
 def compute_title_params(song: Song):
     '''Computes the placement of title and author labels within the header'''
-    title_width = pdfmetrics.stringWidth(song.title, config.font_title.name, config.font_title.size)
+    register_fonts()
+    title_width = string_width(song.title, config.font_title.name, config.font_title.size)
     if song.author is None:
         return TitleParams(song.title, None, -0.5*title_width, 0, 0)
-    author_width = pdfmetrics.stringWidth(song.author, config.font_author.name, config.font_author.size)
+    author_width = string_width(song.author, config.font_author.name, config.font_author.size)
     total_width = title_width + author_width + config.title_author_spacing_x
     if total_width <= config.max_title_width and author_width < 0.5 * title_width:
         # Title and author next to each other
@@ -148,7 +231,75 @@ def compute_title_params(song: Song):
         return TitleParams(song.title, song.author, -0.5*title_width, -0.5*author_width, config.title_author_spacing_y)
         
 
+def compute_page_breaks(pars: List[ParBlock], title: TitleParams):
+    '''Chooses where to split the paragraphs into pages.
+
+    Dynamic programming over paragraph boundaries which minimises, in order:
+    the height overflowing the pages, the number of pages and the sum of squared
+    free space left on the pages (so the pages are balanced). Forced breaks
+    (page_break == True) and forbidden breaks (page_break == False) are honoured.
+    Only breaks within one page height are considered, so the run time is linear
+    in the number of paragraphs times the number of paragraphs fitting on a page.
+
+    Returns the list of paragraph indices starting each page.'''
+    n = len(pars)
+    empty_title = TitleParams("", None, 0, 0, 0)
+    content_height_limit = config.page_size[1] - config.min_top_margin - config.min_bottom_margin - config.min_title_padding
+    prefix = [0]
+    for par in pars:
+        prefix.append(prefix[-1] + par.total_height)
+
+    def free_space(i, j):
+        '''Space left on a page holding paragraphs i..j-1, negative on overflow'''
+        total_text_height = prefix[j] - prefix[i] + (j - i - 1) * config.par_gap
+        total_title_height = config.font_title.size + (title if i == 0 else empty_title).bottom_border
+        return content_height_limit - (total_text_height + total_title_height)
+
+    def can_break(i):
+        return i == 0 or pars[i].page_break is not False
+
+    best = [None for _ in range(n + 1)]
+    previous = [0 for _ in range(n + 1)]
+    best[0] = (0, 0, 0)
+    last_forced = 0
+    for j in range(1, n + 1):
+        if pars[j-1].page_break:
+            last_forced = j - 1
+        candidates = []
+        for i in range(j - 1, last_forced - 1, -1):
+            if can_break(i):
+                candidates.append(i)
+            if free_space(i, j) < 0:
+                break
+        if not candidates:
+            # No allowed break within a page height: overflow from the nearest one
+            candidates = [max(i for i in range(last_forced, j) if can_break(i))]
+        for i in candidates:
+            space = free_space(i, j)
+            cost = (best[i][0] + max(0, -space), best[i][1] + 1, best[i][2] + max(0, space) ** 2)
+            if best[j] is None or cost < best[j]:
+                best[j] = cost
+                previous[j] = i
+
+    starts = []
+    j = n
+    while j > 0:
+        j = previous[j]
+        starts.append(j)
+    return starts[::-1]
+
+
 def compute_block_placement(pars: List[ParBlock], title: TitleParams):
+    '''Splits the paragraphs into pages and places each page'''
+    starts = compute_page_breaks(pars, title)
+    empty_title = TitleParams("", None, 0, 0, 0)
+    placements = []
+    for page, (start, end) in enumerate(zip(starts, starts[1:] + [len(pars)])):
+        placements.append(compute_page_placement(pars[start:end], title if page == 0 else empty_title))
+    return placements
+
+
+def compute_page_placement(pars: List[ParBlock], title: TitleParams):
     # ---------------
     # | top_margin
     # | total_title_height
@@ -157,18 +308,9 @@ def compute_block_placement(pars: List[ParBlock], title: TitleParams):
     # | bottom_margin
     # ---------------
 
-
     total_text_height = sum(par.total_height for par in pars) + (len(pars) - 1) * config.par_gap
     total_title_height = config.font_title.size + title.bottom_border
     content_height = total_text_height + total_title_height
-    content_height_limit = config.page_size[1] - config.min_top_margin - config.min_bottom_margin - config.min_title_padding
-    if content_height > content_height_limit:
-        # Lyrics too long: need to split to multiple pages
-        middle_par = ceil(0.5 * len(pars))
-        empty_title = TitleParams("", None, 0, 0, 0)
-        return [
-            *compute_block_placement(pars[:middle_par], title),
-            *compute_block_placement(pars[middle_par:], empty_title)]
     title_padding = config.page_size[1] - config.preferred_bottom_margin - config.preferred_top_margin - content_height 
     title_padding = max(config.min_title_padding, min(config.optimal_title_padding, title_padding))
     total_content_height = content_height + title_padding
@@ -186,7 +328,12 @@ def compute_block_placement(pars: List[ParBlock], title: TitleParams):
     for i in range(1, len(pars)):
         par_y[i] = par_y[i-1] + pars[i-1].total_height + config.par_gap
 
-    # Compute x position that ensures centering
+    par_x, chords_x_list = compute_horizontal_placement(pars)
+    return BlockPlacement(title_y, par_x, par_y, chords_x_list, title, pars)
+
+
+def compute_horizontal_placement(pars: List[ParBlock]):
+    '''x of the paragraphs (centered on the page) and of their chords'''
     max_width = max(par.total_width for par in pars) 
     par_x = 0.5*(config.page_size[0]-max_width)
     chords_x_list = [config.min_chord_x for _ in range(len(pars))]
@@ -194,34 +341,127 @@ def compute_block_placement(pars: List[ParBlock], title: TitleParams):
         chords_x = par_x + pars[i].lyrics_width + config.chord_gap
         if chords_x > chords_x_list[i]:
             chords_x_list[i] = chords_x
+    return par_x, chords_x_list
 
 
-    return [BlockPlacement(title_y, par_x, par_y, chords_x_list, title, pars)]
+def packed_height(placement: BlockPlacement) -> float:
+    '''Height of a single-page song set compactly, with the smallest title padding'''
+    pars = placement.parblocks
+    total_text_height = sum(par.total_height for par in pars) + (len(pars) - 1) * config.par_gap
+    return config.font_title.size + placement.title_params.bottom_border + config.min_title_padding + total_text_height
+
+
+class PackedPage:
+    '''Several short songs stacked on one page, sources are their (song, page index)'''
+    __slots__ = ("placements", "sources")
+
+    def __init__(self, placements: List[BlockPlacement], sources):
+        self.placements = placements
+        self.sources = sources
+
+
+def stack_placements(placements: List[BlockPlacement], sources) -> PackedPage:
+    '''Places songs under each other on one page, the free space is split
+    between the margins like on single-song pages'''
+    heights = [packed_height(placement) for placement in placements]
+    total_height = sum(heights) + (len(heights) - 1) * config.song_gap
+    y = max(config.min_top_margin, 0.4 * (config.page_size[1] - total_height))
+    stacked = []
+    for placement, height in zip(placements, heights):
+        title, pars = placement.title_params, placement.parblocks
+        par_y = [y + config.font_title.size + title.bottom_border + config.min_title_padding]
+        for par in pars[:-1]:
+            par_y.append(par_y[-1] + par.total_height + config.par_gap)
+        par_x, chords_x_list = compute_horizontal_placement(pars)
+        stacked.append(BlockPlacement(y, par_x, par_y, chords_x_list, title, pars))
+        y += height + config.song_gap
+    return PackedPage(stacked, sources)
+
+
+def pack_songs(songs: List[Song], groups: List[List[BlockPlacement]], window: int):
+    '''Puts several single-page songs on one page where they fit.
+
+    The songs are split into windows of consecutive songs and each window is
+    packed first-fit decreasing by packed_height, so a song moves at most
+    window songs away from its place in the sort order. Pages (and multi-page
+    songs) are ordered by their first song. Returns the page groups for
+    schedule_pages, packed pages are PackedPage objects.'''
+    content_height = config.page_size[1] - config.min_top_margin - config.min_bottom_margin
+    packed = []
+    for start in range(0, len(groups), window):
+        indices = range(start, min(start + window, len(groups)))
+        bins = []
+        for i in sorted(indices, key=lambda i: -packed_height(groups[i][0]) if len(groups[i]) == 1 else 0):
+            if len(groups[i]) != 1:
+                packed.append((i, groups[i]))
+                continue
+            height = packed_height(groups[i][0])
+            for used in bins:
+                if used[0] + config.song_gap + height <= content_height:
+                    used[0] += config.song_gap + height
+                    used[1].append(i)
+                    break
+            else:
+                bins.append([height, [i]])
+        for _, members in bins:
+            members.sort()
+            if len(members) == 1:
+                packed.append((members[0], groups[members[0]]))
+            else:
+                page = stack_placements([groups[i][0] for i in members], [(songs[i], 0) for i in members])
+                packed.append((members[0], [page]))
+    packed.sort(key=lambda item: item[0])
+    return [group for _, group in packed]
+
+
+class TextWriter:
+    '''All text of a page goes into one text object: every line only moves the
+    text origin, runs follow each other by the font advance and the font is
+    set only when it differs from the current one'''
+    def __init__(self, canvas: canvas):
+        self.canvas = canvas
+        self.text = canvas.beginText()
+        self.font = None
+
+    def set_font(self, font: FontConfig):
+        if font is not self.font:
+            self.text.setFont(font.name, font.size)
+            self.font = font
+
+    def write(self, x: float, y: float, font: FontConfig, runs):
+        if not runs:
+            return
+        self.text.setTextOrigin(x, y)
+        for comment, string in runs:
+            self.set_font(config.font_comment if comment else font)
+            self.text.textOut(string)
+
+    def close(self):
+        self.canvas.drawText(self.text)
 
 
 def print_to_canvas(placement: BlockPlacement, canvas: canvas, page_number: int | None = None, x_offset: float = 0.0):
     title = placement.title_params
     pars = placement.parblocks
     W, H = config.page_size
-    canvas.setFont(config.font_title.name, config.font_title.size)
-    canvas.drawString(W/2 + x_offset + title.title_xoffset, placement.title_y, title.title)
+    writer = TextWriter(canvas)
+    writer.write(W/2 + x_offset + title.title_xoffset, placement.title_y, config.font_title, ((False, title.title),))
     if title.author is not None:
-        canvas.setFont(config.font_author.name, config.font_author.size)
-        canvas.drawString(W/2 + x_offset + title.author_xoffset, placement.title_y + title.author_yoffset, title.author)
-    
+        writer.write(W/2 + x_offset + title.author_xoffset, placement.title_y + title.author_yoffset, config.font_author, ((False, title.author),))
+
+    # All lyrics first and then all chords, so the font changes only for comments
+    for y, par in zip(placement.pars_y_list, pars):
+        for i, runs in enumerate(par.lyrics_runs):
+            writer.write(placement.pars_x + par.x_offset + x_offset, y + i * config.line_spacing, config.font_lyrics, runs)
     for chords_x, y, par in zip(placement.chords_x_list, placement.pars_y_list, pars):
-        canvas.setFont(config.font_lyrics.name, config.font_lyrics.size)
-        for i, line in enumerate(par.lyrics_lines):
-            drawStringOrComment(placement.pars_x + par.x_offset + x_offset, y + i * config.line_spacing, config.font_lyrics, line, canvas)
-        canvas.setFont(config.font_chords.name, config.font_chords.size)
-        for i, line in enumerate(par.chords_lines):
-            drawStringOrComment(chords_x + x_offset, y + i * config.line_spacing, config.font_chords, line, canvas)
-    
-    if page_number is not None:
-        canvas.setFont(config.font_chords.name, config.font_chords.size)
-        canvas.drawCentredString(W/2 + x_offset, H - 25, str(page_number))
+        for i, runs in enumerate(par.chords_runs):
+            writer.write(chords_x + x_offset, y + i * config.line_spacing, config.font_chords, runs)
 
-    canvas.showPage()
+    if page_number is not None:
+        number = str(page_number)
+        width = string_width(number, config.font_chords.name, config.font_chords.size)
+        writer.write(W/2 + x_offset - 0.5*width, H - 25, config.font_chords, ((False, number),))
+    writer.close()
 
 
 def performChordStrReplacements(chords: str):
@@ -233,91 +473,358 @@ def performChordStrReplacements(chords: str):
     return chords
     
 
-def drawStringOrComment(x: float, y: float, font: FontConfig, line: str, canvas: canvas):
-    strings = []
-    types = []
-    last_idx = 0
-    for match in re.finditer(r'\[[^\[\]]*\]', line):
-        if match.span()[0] > last_idx:
-            strings.append(line[last_idx:match.span()[0]])
-            types.append(0)
-        strings.append(line[match.span()[0]+1:match.span()[1]-1])
-        types.append(1)
-        last_idx = match.span()[1]
-    strings.append(line[last_idx:len(line)])
-    types.append(0)
-    
-    for string, type in zip(strings, types):
-        if type == 0:
-            selected_font = font
-        else:
-            selected_font = config.font_comment
-        
-        canvas.setFont(selected_font.name, selected_font.size)
-        canvas.drawString(x, y, string)
-        x += pdfmetrics.stringWidth(string, selected_font.name, selected_font.size)
-        
+def compile_single_song(song: Song):
+    with profiling.measure("width", song.title):
+        parblocks = parse_song_lyrics(song)
+        titleblock = compute_title_params(song)
+    with profiling.measure("placement", song.title):
+        placements = compute_block_placement(parblocks, titleblock)
+    return placements
 
 
+def compile_single_song_data(song: Song):
+    '''Lays out a song and returns the placements as plain (picklable, JSON-able) data'''
+    return [placement.to_dict() for placement in compile_single_song(song)]
 
 
+def report_width_lookups(before):
+    '''Reports the string_width cache hits and misses since the cache_info
+    before to the profiling hooks (each process has its own cache)'''
+    after = string_width.cache_info()
+    profiling.width_lookups(after.hits - before.hits, after.misses - before.misses)
 
-def compile_single_song(song: Song):
-    parblocks = parse_song_lyrics(song)
-    titleblock = compute_title_params(song)
-    placements = compute_block_placement(parblocks, titleblock)
-    return placements
+
+def compile_single_song_data_profiled(song: Song):
+    '''compile_single_song_data for worker processes, which also returns the
+    events to replay to the hooks of the main process'''
+    recorder = profiling.Recorder()
+    profiling.add_hook(recorder)
+    widths = string_width.cache_info()
+    try:
+        data = compile_single_song_data(song)
+        report_width_lookups(widths)
+        return data, recorder.events
+    finally:
+        profiling.remove_hook(recorder)
+
+
+def compile_songs(songs: List[Song], cache: LayoutCache | None = None, jobs: int = 1):
+    '''Lays out all songs, spreading cache misses over a process pool when jobs > 1.
+
+    Both the serial and the parallel path produce plain placement data which is
+    then turned back into BlockPlacement objects, so the rendered PDF does not
+    depend on the number of jobs.'''
+    layouts = [None for _ in range(len(songs))]
+    missing = []
+    for i, song in enumerate(songs):
+        if cache is not None:
+            layouts[i] = cache.get(song)
+        if layouts[i] is None:
+            missing.append(i)
+
+    missing_songs = [songs[i] for i in missing]
+    if jobs > 1 and len(missing_songs) > 1:
+        chunksize = max(1, len(missing_songs) // (4*jobs))
+        with ProcessPoolExecutor(jobs) as pool:
+            if profiling.hooks:
+                results = []
+                for data, events in pool.map(compile_single_song_data_profiled, missing_songs, chunksize=chunksize):
+                    profiling.replay(events)
+                    results.append(data)
+            else:
+                results = list(pool.map(compile_single_song_data, missing_songs, chunksize=chunksize))
+    else:
+        results = [compile_single_song_data(song) for song in missing_songs]
+
+    for i, data in zip(missing, results):
+        layouts[i] = data
+        if cache is not None:
+            cache.put(songs[i], data)
+    for song, data in zip(songs, layouts):
+        profiling.song_laid_out(song.title, len(data))
+    return [[BlockPlacement.from_dict(placement) for placement in data] for data in layouts]
+
+
+def load_svg_drawing(path: str, cache_dir: str = ".cache/svg"):
+    '''Parses an SVG file with svg2rlg, reusing a pickled drawing cached by file content'''
+    with open(path, "rb") as file:
+        data = file.read()
+    cache_path = os.path.join(cache_dir, hashlib.sha256(data).hexdigest() + ".pickle")
+    try:
+        with open(cache_path, "rb") as file:
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        pass
+    from svglib.svglib import svg2rlg
+    drawing = svg2rlg(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(drawing, file)
+    os.replace(tmp_path, cache_path)
+    return drawing
+
+
+@functools.cache
+def footer_images():
+    '''Loads the (left page, right page) footer drawings on first use'''
+    return load_svg_drawing("scripts/flowers.svg"), load_svg_drawing("scripts/flowers-flipped.svg")
+
+
+def footer_form_name(left_page: bool):
+    return "FooterLeft" if left_page else "FooterRight"
+
+
+def define_footer_forms(canvas: canvas):
+    '''Draws both footer images once as form XObjects, pages only reference them'''
+    canvas_height = canvas._pagesize[1]
+    for left_page in (True, False):
+        image = footer_images()[0 if left_page else 1]
+        x_offset = 0 if left_page else config.page_size[0] - image.width
+        y_offset = 0 if not left_page else config.page_size[1] - image.height
+        # The form is drawn top-down like the pages, so on canvases of other
+        # sizes its box is shifted by the top-down flip of the canvas
+        canvas.beginForm(footer_form_name(left_page), 0, canvas_height - config.page_size[1], config.page_size[0], canvas_height)
+        renderPDF.draw(image, canvas, x_offset, y_offset)
+        # reportlab leaves the graphics states (transparency) out of form
+        # resources, so they have to be passed explicitly
+        resources = pdfdoc.PDFResourceDictionary()
+        resources.basicFonts()
+        resources.allProcs()
+        resources.ExtGState = canvas._extgstate.getState() or {}
+        canvas.endForm(Resources=resources)
 
 
-footer_image = svg2rlg("scripts/flowers.svg")
-footer_image_flipped = svg2rlg("scripts/flowers-flipped.svg")
 def add_footer_image(canvas: canvas, left_page: bool):
-    image = footer_image if left_page else footer_image_flipped
-    x_offset = 0 if left_page else config.page_size[0] - image.width
-    y_offset = 0 if not left_page else config.page_size[1] - image.height
-    renderPDF.draw(image, canvas, x_offset, y_offset)
+    with profiling.measure("footer"):
+        canvas.saveState()
+        # Forms carry their own top-down flip, so undo the one of the page
+        canvas.transform(1, 0, 0, -1, 0, canvas._pagesize[1])
+        canvas.doForm(footer_form_name(left_page))
+        canvas.restoreState()
+
+
+
+def schedule_pages(groups: List[List[BlockPlacement]], max_distance: int):
+    '''Orders the pages of all songs so that every multi-page song starts on an
+    even (left) page and is read on facing pages.
+
+    Songs keep their order, except that when a multi-page song would start on an
+    odd page the nearest single-page song among the next max_distance songs is
+    moved in front of it. Only when there is none, a blank page (None) is
+    inserted. Runs in O(len(groups) * max_distance).'''
+    pages = []
+    taken = [False for _ in range(len(groups))]
+    i = 0
+    while i < len(groups):
+        if taken[i]:
+            i += 1
+            continue
+        if len(groups[i]) > 1 and len(pages) % 2 == 0:
+            # The song would start on an odd page
+            filler = None
+            for j in range(i + 1, min(len(groups), i + 1 + max_distance)):
+                if not taken[j] and len(groups[j]) == 1:
+                    filler = j
+                    break
+            if filler is None:
+                pages.append(None)
+            else:
+                taken[filler] = True
+                pages.extend(groups[filler])
+            continue
+        taken[i] = True
+        pages.extend(groups[i])
+        i += 1
+    return pages
+
+
+def draw_page(canvas: canvas, page: BlockPlacement | PackedPage | None, page_number: int, song: str | None = None):
+    '''Draws one book page (footer and songs) in book page coordinates, song is
+    the title reported to profiling hooks (packed pages name their own songs)'''
+    left_page = page_number % 2 == 0
+    x_offset = -config.page_bind_offset if left_page else config.page_bind_offset
+    add_footer_image(canvas, left_page)
+    if page is None:
+        return
+    if isinstance(page, PackedPage):
+        parts = [(placement, source[0].title) for placement, source in zip(page.placements, page.sources)]
+    else:
+        parts = [(page, song)]
+    for i, (placement, title) in enumerate(parts):
+        with profiling.measure("draw", title):
+            print_to_canvas(placement, canvas, page_number if config.pagenos and i == 0 else None, x_offset)
 
 
+def font_charsets(pages: List[BlockPlacement | PackedPage | None]):
+    '''Characters drawn in every font, by font name'''
+    charsets = {}
+    def add(font: FontConfig, text: str):
+        charsets.setdefault(font.name, set()).update(text)
 
-def compile(songs: Song | List[Song], output_path: str):
-    c = canvas.Canvas(output_path, config.page_size, bottomup=False)
-    if not type(songs) == list:
-        songs = [songs]
     placements = []
-    for song in songs:
-        placements.append(compile_single_song(song))
-    
-    print(max(len(placement) for placement in placements))
-
-    # Ensure that two-page songs always start from even pages
-    page_number = 1
-    for i in range(len(placements)):
-        pages = len(placements[i])
-        if page_number % 2 == 1:
-            if len(placements[i]) > 1:
-                swap = placements[i]
-                placements[i] = placements[i-1]
-                placements[i-1] = swap
-        page_number += pages
-
-    page_number = 1
-    for group in placements:
-        for placement in group:
-            x_offset = config.page_bind_offset
-            if page_number % 2 == 0:
-                x_offset = -x_offset
-            add_footer_image(c, page_number % 2 == 0)
-            print_to_canvas(placement, c, page_number if config.pagenos else None, x_offset)
-            page_number += 1
-    c.save()
-    print(f"Saved output to {output_path}.")
-
-
-def sort_songs(songs : List[Song]):
+    for page in pages:
+        if isinstance(page, PackedPage):
+            placements.extend(page.placements)
+        elif page is not None:
+            placements.append(page)
+    for placement in placements:
+        add(config.font_title, placement.title_params.title)
+        if placement.title_params.author is not None:
+            add(config.font_author, placement.title_params.author)
+        for par in placement.parblocks:
+            for font, lines in ((config.font_lyrics, par.lyrics_runs), (config.font_chords, par.chords_runs)):
+                for runs in lines:
+                    for comment, text in runs:
+                        add(config.font_comment if comment else font, text)
+    if config.pagenos:
+        add(config.font_chords, "0123456789")
+    return charsets
+
+
+def seed_font_subsets(canvas: canvas, charsets):
+    '''Assigns the subset codes of all characters up front, in code point order.
+
+    reportlab embeds only the used glyphs of a TTF, but numbers them in order
+    of first use, so the embedded subsets and the encoded text of a page would
+    depend on everything drawn before it. Seeded, they depend only on the
+    characters of the whole book and are the same in every target.'''
+    for font_name in sorted(charsets):
+        pdfmetrics.getFont(font_name).splitString("".join(sorted(charsets[font_name])), canvas._doc)
+
+
+@contextmanager
+def binary_streams():
+    '''Pdfs saved inside use binary streams: ASCII85 makes the embedded fonts
+    and page contents 25% bigger and is slow to encode. rl_config is shared by
+    the whole process, so the previous setting is restored afterwards.'''
+    use_a85 = rl_config.useA85
+    rl_config.useA85 = 0
+    try:
+        yield
+    finally:
+        rl_config.useA85 = use_a85
+
+
+def new_canvas(output_path: str | BinaryIO, page_size, pages: List[BlockPlacement | None]):
+    '''Top-down canvas with the footer forms defined and the font subsets seeded'''
+    c = canvas.Canvas(output_path, page_size, bottomup=False)
+    seed_font_subsets(c, font_charsets(pages))
+    with profiling.measure("footer"):
+        define_footer_forms(c)
+    return c
+
+
+class PageTarget:
+    '''Output with one book page per pdf page, scaled to the target page size'''
+    def __init__(self, output_path: str | BinaryIO, page_size=None):
+        self.output_path = output_path
+        self.page_size = page_size or config.page_size
+
+    def render(self, pages: List[BlockPlacement | None], page_songs: List[str | None] | None = None):
+        page_songs = page_songs or [None] * len(pages)
+        with binary_streams():
+            c = new_canvas(self.output_path, self.page_size, pages)
+            W, H = config.page_size
+            scale = min(self.page_size[0] / W, self.page_size[1] / H)
+            for page_number, placement in enumerate(pages, 1):
+                if scale != 1:
+                    c.translate(0.5 * (self.page_size[0] - scale * W), 0.5 * (self.page_size[1] - scale * H))
+                    c.scale(scale, scale)
+                draw_page(c, placement, page_number, page_songs[page_number - 1])
+                c.showPage()
+            with profiling.measure("save"):
+                c.save()
+
+
+class BookletTarget:
+    '''A4 sheets with two book pages per side, in booklet printing order'''
+    def __init__(self, output_path: str | BinaryIO, signature_sheets: int = 1):
+        self.output_path = output_path
+        self.signature_sheets = signature_sheets
+
+    def render(self, pages: List[BlockPlacement | None], page_songs: List[str | None] | None = None):
+        from impose_a5_to_a4 import booklet_order
+        page_songs = page_songs or [None] * len(pages)
+        W, H = config.page_size
+        with binary_streams():
+            c = new_canvas(self.output_path, (A4[1], A4[0]), pages)
+            for left, right in booklet_order(len(pages), self.signature_sheets):
+                for idx, x in ((left, 0), (right, A4[1] / 2)):
+                    if idx is None:
+                        continue
+                    c.saveState()
+                    c.translate(x, 0)
+                    clip = c.beginPath()
+                    clip.rect(0, 0, W, H)
+                    c.clipPath(clip, stroke=0, fill=0)
+                    draw_page(c, pages[idx], idx + 1, page_songs[idx])
+                    c.restoreState()
+                c.showPage()
+            with profiling.measure("save"):
+                c.save()
+
+
+def render_target_profiled(target, pages: List[BlockPlacement | PackedPage | None], page_songs: List[str | None]):
+    '''target.render for worker processes, returns the events to replay to the
+    hooks of the main process'''
+    recorder = profiling.Recorder()
+    profiling.add_hook(recorder)
+    widths = string_width.cache_info()
     try:
-        songs.sort(key=lambda x: locale.strxfrm(x.title.replace(" ", "")))
-    except AttributeError:
-        songs.sort(key=lambda x: locale.strxfrm(x["title"].replace(" ", "")))
+        target.render(pages, page_songs)
+        report_width_lookups(widths)
+        return recorder.events
+    finally:
+        profiling.remove_hook(recorder)
+
+
+def render_targets(targets, pages: List[BlockPlacement | PackedPage | None], page_songs: List[str | None], jobs: int = 1):
+    '''Draws the pages onto every target, each target in its own worker process
+    when jobs > 1 (only targets writing to files, a BytesIO would be filled in
+    the worker). Every target draws the placements directly on its canvas.'''
+    if jobs > 1 and len(targets) > 1 and all(isinstance(target.output_path, str) for target in targets):
+        with ProcessPoolExecutor(min(jobs, len(targets))) as pool:
+            runs = [pool.submit(render_target_profiled, target, pages, page_songs) for target in targets]
+            for run in runs:
+                profiling.replay(run.result())
+    else:
+        for target in targets:
+            target.render(pages, page_songs)
+
+
+def compile(songs: Song | List[Song], output_path: str | BinaryIO, cache: LayoutCache | None = None, jobs: int = 1, extra_targets=(),
+            pack: bool = False):
+    '''Lays the songs out once and renders the pages to the main pdf and to
+    every extra target (e.g. BookletTarget, PageTarget(path, A6)). With pack,
+    short songs share pages (see pack_songs).'''
+    register_fonts()
+    widths = string_width.cache_info()
+    if not type(songs) == list:
+        songs = [songs]
+    placements = compile_songs(songs, cache, jobs)
+    if cache is not None:
+        print(cache.report())
+
+    page_song = {id(placement): song.title for song, group in zip(songs, placements) for placement in group}
+    groups = placements
+    if pack:
+        groups = pack_songs(songs, placements, config.pack_window)
+        packed_pages = sum(1 for group in groups if isinstance(group[0], PackedPage))
+        print(f"Packed {len(placements) - len(groups) + packed_pages} songs onto {packed_pages} shared pages.")
+
+    pages = schedule_pages(groups, config.max_reorder_distance)
+    blank_pages = pages.count(None)
+    if blank_pages:
+        print(f"Inserted {blank_pages} blank pages to keep multi-page songs on facing pages.")
+
+    page_songs = [None if isinstance(page, PackedPage) else page_song.get(id(page)) for page in pages]
+    render_targets([PageTarget(output_path), *extra_targets], pages, page_songs, jobs)
+    report_width_lookups(widths)
+    if isinstance(output_path, str):
+        print(f"Saved output to {output_path}.")
+
+
 
 
 
@@ -330,9 +837,22 @@ def main():
     # nargs='+' collects 1 or more arguments into a list
     parser.add_argument(
         'input_files', 
-        nargs='+', 
+        nargs='*', 
         help="Path to .fasta files. Supports wildcards (e.g., songs/*.fasta)"
     )
+
+    parser.add_argument(
+        '-s', '--song',
+        action='append',
+        default=[],
+        help="Compile only the song with this title, read through song_manifest.json (can be repeated)"
+    )
+
+    parser.add_argument(
+        '--manifest',
+        default='song_manifest.json',
+        help="Manifest used by --song (default: song_manifest.json)"
+    )
     
     parser.add_argument(
         '-o', '--output', 
@@ -340,36 +860,143 @@ def main():
         help="Output filename (default: pdf/Śpiewnik.pdf)"
     )
 
+    parser.add_argument(
+        '--cache-dir',
+        default='.cache/layout',
+        help="Directory for cached song layouts (default: .cache/layout)"
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Compute all layouts from scratch without reading or writing the cache"
+    )
+
+    parser.add_argument(
+        '--prune-cache',
+        action='store_true',
+        help="After building, delete the cached layouts this build did not use (build the whole book with it)"
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help="Number of worker processes for parsing and layout (default: 1)"
+    )
+
+    parser.add_argument(
+        '-t', '--transpose',
+        type=int,
+        default=0,
+        help="Transpose all chords by this many half-steps"
+    )
+
+    parser.add_argument(
+        '--booklet',
+        help="Also write an A4 booklet for printing to this file (e.g. pdf/Śpiewnik-printableA4.pdf)"
+    )
+
+    parser.add_argument(
+        '--pocket',
+        help="Also write an A6 pocket edition to this file (e.g. pdf/Śpiewnik-A6.pdf)"
+    )
+
+    parser.add_argument(
+        '--pack',
+        action='store_true',
+        help="Put several short songs on one page to save pages"
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="Print the time and call count of every build stage, the slowest songs and the songs on several pages"
+    )
+
+    parser.add_argument(
+        '--signature-sheets',
+        type=int,
+        default=1,
+        help="Sheets per signature of the booklet, 0 for a single saddle-stitched one (default: 1)"
+    )
+
+    parser.add_argument(
+        '-w', '--watch',
+        action='store_true',
+        help="Keep running and rebuild whenever one of the input files changes"
+    )
+
+    parser.add_argument(
+        '--preview',
+        help="With --watch, write only the changed songs to this file instead of rebuilding the book"
+    )
+
     args = parser.parse_args()
+    if not args.input_files and not args.song:
+        parser.error("give .fasta files or --song titles")
+    if args.watch and args.song:
+        parser.error("--watch works on input files, not --song titles")
+    if args.watch and args.profile:
+        parser.error("--profile reports a single build, it does not work with --watch")
+    if args.preview is not None and not args.watch:
+        parser.error("--preview needs --watch")
+    if args.prune_cache and (args.no_cache or args.song or args.watch):
+        parser.error("--prune-cache needs a full build with the cache (no --no-cache, --song or --watch)")
+
+    for path in [args.output, args.booklet, args.pocket, args.preview]:
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    cache = None if args.no_cache else LayoutCache(args.cache_dir, config_fingerprint(config))
+    extra_targets = []
+    if args.booklet is not None:
+        extra_targets.append(BookletTarget(args.booklet, args.signature_sheets))
+    if args.pocket is not None:
+        extra_targets.append(PageTarget(args.pocket, A6))
+
+    if args.watch:
+        from watch import SongbookWatcher
+        SongbookWatcher(args.input_files, args.output, MemoryLayoutCache(cache), args.transpose, args.preview, extra_targets,
+                        args.jobs, args.pack).run()
+        return
+
+    profiler = None
+    if args.profile:
+        profiler = profiling.Profiler()
+        profiling.add_hook(profiler)
 
     all_songs = []
-    
-    # Process each filename provided
-    for pattern in args.input_files:
-        # glob.glob handles cases where the shell might not expand the *
-        for filename in glob.glob(pattern):
-            if os.path.isfile(filename):
-                with open(filename, 'r', encoding='utf-8') as f:
-                    songs = Song.load_from_fasta(f.read())
-                    all_songs.extend(songs)
+    if args.song:
+        # Only the requested songs are parsed, not their whole files
+        store = SongStore.load(args.manifest)
+        try:
+            for title in args.song:
+                with profiling.measure("load", title):
+                    all_songs.append(store.song_by_title(title))
+        except KeyError as e:
+            parser.error(e.args[0])
+        store.close()
+    else:
+        with profiling.measure("load"):
+            all_songs = load_songs(args.input_files, args.jobs)
 
     if not all_songs:
         print("No songs found. Check your file paths.")
         return
-    
-    sort_songs(all_songs)
+    report_duplicate_titles(all_songs)
 
-    # selected_song = []
-    # for song in all_songs:
-    #     if song.title.lower().startswith("niemanie"):
-    #         selected_song.append(song)
-    # all_songs = selected_song
-
-    if not os.path.exists(os.path.dirname(args.output)):
-        os.mkdir(os.path.dirname(args.output))
-
-    compile(all_songs, args.output)
-    print(f"Successfully created {args.output}")
+    sort_songs(all_songs)
+    all_songs = transpose_songs(all_songs, args.transpose)
+
+    compile(all_songs, args.output, cache, args.jobs, extra_targets, args.pack)
+    if args.prune_cache:
+        print(f"Removed {cache.prune()} unused cached layouts.")
+    for path in [args.output, args.booklet, args.pocket]:
+        if path is not None:
+            print(f"Successfully created {path}")
+    if profiler is not None:
+        print(profiler.report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,17 +1,10 @@
 import os
-from song import Song
-from compile import sort_songs
+from song import sort_songs
+from song_store import SongStore
 
-files = filter(lambda x: len(x) >= 6 and x[-6:] == ".fasta", os.listdir(os.getcwd()+"/songs"))
-
-songs = []
-
-for path in files:
-    with open("songs/"+path, 'r') as f:
-        loaded_songs = Song.load_from_fasta(f.read())
-        song: Song
-        for song in loaded_songs:
-            songs.append({"title": song.title, "author": song.author, "file": path})
+# Titles and authors come from the manifest written by build_song_index.py
+songs = [{"title": entry["title"], "author": entry["author"], "file": os.path.basename(entry["file"])}
+         for entry in SongStore.load().entries]
 
 sort_songs(songs)
 
@@ -1,43 +1,88 @@
-from pypdf import PdfReader, PdfWriter, PageObject, Transformation
+import argparse
+from typing import Iterator, List, Tuple
+
+from pypdf import PdfReader, PdfWriter, PageObject
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
 from reportlab.lib.pagesizes import A4
 
 
-def impose(input_path, output_path):
-    reader = PdfReader(input_path)
+def booklet_order(num_pages: int, signature_sheets: int = 1) -> Iterator[Tuple[int | None, int | None]]:
+    '''Yields (left, right) page indices for every side of every A4 sheet, None
+    where a blank page is needed.
+
+    Pages are folded in signatures of signature_sheets sheets (4 pages per
+    sheet) which are then stacked; signature_sheets=0 makes a single
+    saddle-stitched signature of the whole book.'''
+    padded = num_pages + (-num_pages) % 4
+    signature_pages = padded if signature_sheets == 0 else 4 * signature_sheets
+
+    def page(idx):
+        return idx if idx < num_pages else None
+
+    for base in range(0, padded, signature_pages):
+        size = min(signature_pages, padded - base)
+        for sheet in range(size // 4):
+            yield page(base + size - 1 - 2*sheet), page(base + 2*sheet)
+            yield page(base + 2*sheet + 1), page(base + size - 2 - 2*sheet)
+
+
+def page_to_form(page: PageObject, writer: PdfWriter):
+    '''Wraps a page as a form XObject in the writer, so it can be placed on a
+    sheet by reference instead of merging (and copying) its content stream'''
+    form = DecodedStreamObject()
+    form.set_data(page.get_contents().get_data())
+    form = form.flate_encode()
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = ArrayObject([FloatObject(value) for value in page.mediabox])
+    form[NameObject("/Resources")] = page["/Resources"].clone(writer)
+    return writer._add_object(form)
+
+
+def impose(input_pdf, output_path, signature_sheets: int = 1):
+    '''Imposes A5 pages two per A4 side for booklet printing.
+
+    input_pdf can be a path, a binary file object (e.g. the BytesIO written by
+    compile()) or a PdfReader, output_path a path or a binary file object.
+    Sheets are produced one by one and every source page is read only when
+    its sheet is reached.'''
+    reader = input_pdf if isinstance(input_pdf, PdfReader) else PdfReader(input_pdf)
     writer = PdfWriter()
+    width, height = A4[1], A4[0]
+
+    for left, right in booklet_order(len(reader.pages), signature_sheets):
+        sheet = PageObject.create_blank_page(width=width, height=height)
+        xobjects = DictionaryObject()
+        content: List[str] = []
+        for name, idx, x in (("/Left", left, 0), ("/Right", right, width/2)):
+            if idx is None:
+                continue
+            xobjects[NameObject(name)] = page_to_form(reader.pages[idx], writer)
+            content.append(f"q 1 0 0 1 {x:.4f} 0 cm {name} Do Q")
+        stream = DecodedStreamObject()
+        stream.set_data("\n".join(content).encode())
+        sheet[NameObject("/Resources")] = DictionaryObject({NameObject("/XObject"): xobjects})
+        sheet[NameObject("/Contents")] = writer._add_object(stream.flate_encode())
+        writer.add_page(sheet)
+
+    writer.write(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Impose an A5 pdf onto A4 sheets for booklet printing."
+    )
+    parser.add_argument('input', nargs='?', default="pdf/Śpiewnik.pdf", help="A5 pdf (default: pdf/Śpiewnik.pdf)")
+    parser.add_argument('output', nargs='?', default="pdf/Śpiewnik-printableA4.pdf", help="Output pdf (default: pdf/Śpiewnik-printableA4.pdf)")
+    parser.add_argument(
+        '-s', '--signature-sheets',
+        type=int,
+        default=1,
+        help="Sheets folded together per signature, 0 for one saddle-stitched booklet (default: 1)"
+    )
+    args = parser.parse_args()
+    impose(args.input, args.output, args.signature_sheets)
 
-    pages = list(reader.pages)
-    while len(pages) % 4 !=0:
-        pages.append(PageObject.create_blank_page(width=pages[0].mediabox.width, height=pages[0].mediabox.height))
-    
-    num_pages = len(pages)
-    num_sheets = num_pages // 4
-
-    order = []
-    for i in range(num_sheets):
-        order.append(pages[4*i+3])
-        order.append(pages[4*i+0])
-        order.append(pages[4*i+1])
-        order.append(pages[4*i+2])
-
-    for i in range(0, len(reader.pages), 2):
-        new_page = PageObject.create_blank_page(width=A4[1], height=A4[0])
-        p1 = order[i]
-        p1.add_transformation(Transformation().translate(tx=0, ty=0))
-
-        p2 = order[i+1]
-        p2.add_transformation(Transformation().translate(tx=A4[1]/2, ty=0))
-        p2.mediabox.bottom_left = (A4[1]/2, 0)
-        p2.mediabox.upper_right = (A4[1], A4[0])
-
-        new_page.merge_page(p1)
-        new_page.merge_page(p2)
-
-        writer.add_page(new_page)
-    
-    with open(output_path, "wb") as file:
-        writer.write(file)
-    
 
 if __name__=="__main__":
-    impose("pdf/Śpiewnik.pdf", "pdf/Śpiewnik-printableA4.pdf")
\ No newline at end of file
+    main()
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+from song import Song
+
+
+class LayoutCache:
+    '''On-disk store of per-song layout data.
+
+    Entries are keyed by the song content hash combined with a fingerprint of
+    the compilation config, so changing a single song only invalidates that
+    song and changing the config invalidates everything.'''
+    def __init__(self, directory: str, config_fingerprint: str):
+        self.directory = directory
+        self.config_fingerprint = config_fingerprint
+        self.hits = 0
+        self.misses = 0
+        # Keys read or written by this build, see prune
+        self.used = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, song: Song) -> str:
+        return hashlib.sha256(f"{self.config_fingerprint}:{song.content_hash()}".encode()).hexdigest()
+
+    def path(self, song: Song) -> str:
+        return os.path.join(self.directory, self.key(song) + ".json")
+
+    def get(self, song: Song):
+        self.used.add(self.key(song))
+        try:
+            with open(self.path(song), "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, song: Song, data):
+        self.used.add(self.key(song))
+        path = self.path(song)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def prune(self) -> int:
+        '''Deletes the entries this build did not use (removed or edited songs,
+        old configs) and returns how many. Only meaningful after building the
+        whole book.'''
+        removed = 0
+        for filename in os.listdir(self.directory):
+            key, extension = os.path.splitext(filename)
+            if extension == ".json" and key not in self.used:
+                os.remove(os.path.join(self.directory, filename))
+                removed += 1
+        return removed
+
+    def report(self) -> str:
+        return f"Layout cache: {self.hits} hits, {self.misses} misses"
+
+
+class MemoryLayoutCache:
+    '''Layouts kept in memory for a long-running process (compile.py --watch),
+    in front of an optional on-disk LayoutCache with the same interface'''
+    def __init__(self, backing: LayoutCache | None = None):
+        self.backing = backing
+        self.layouts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, song: Song):
+        data = self.layouts.get(song.content_hash())
+        if data is None and self.backing is not None:
+            data = self.backing.get(song)
+            if data is not None:
+                self.layouts[song.content_hash()] = data
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, song: Song, data):
+        self.layouts[song.content_hash()] = data
+        if self.backing is not None:
+            self.backing.put(song, data)
+
+    def report(self) -> str:
+        return f"Layout cache: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,131 @@
+import time
+from contextlib import nullcontext
+from typing import Dict, List
+
+# Installed hooks, see add_hook
+hooks: List['Hook'] = []
+
+
+class Hook:
+    '''Receives build events, subclasses override the ones they need.
+
+    Stages reported by compile.py: "load" (reading .fasta files), "width"
+    (measuring paragraphs and titles), "placement" (page breaks and block
+    positions), "draw" (a song page on the canvas), "footer" (footer forms and
+    their use on a page) and "save" (writing the pdf). width_lookups gives the
+    hits and misses of the text width cache of a build (or of one worker).'''
+    def stage(self, name: str, song: str | None, seconds: float):
+        pass
+
+    def song_laid_out(self, song: str, pages: int):
+        pass
+
+    def width_lookups(self, hits: int, misses: int):
+        pass
+
+
+def add_hook(hook: Hook):
+    hooks.append(hook)
+
+
+def remove_hook(hook: Hook):
+    hooks.remove(hook)
+
+
+class _Measurement:
+    __slots__ = ("name", "song", "start")
+
+    def __init__(self, name: str, song: str | None):
+        self.name = name
+        self.song = song
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        for hook in hooks:
+            hook.stage(self.name, self.song, seconds)
+
+
+def measure(name: str, song: str | None = None):
+    '''Context manager reporting the time of a stage to the hooks, it does
+    nothing (not even read the clock) when no hook is installed'''
+    return _Measurement(name, song) if hooks else nullcontext()
+
+
+def song_laid_out(song: str, pages: int):
+    for hook in hooks:
+        hook.song_laid_out(song, pages)
+
+
+def width_lookups(hits: int, misses: int):
+    for hook in hooks:
+        hook.width_lookups(hits, misses)
+
+
+class Recorder(Hook):
+    '''Keeps stage and width events to be replayed in another process'''
+    def __init__(self):
+        self.events = []
+
+    def stage(self, name: str, song: str | None, seconds: float):
+        self.events.append(("stage", (name, song, seconds)))
+
+    def width_lookups(self, hits: int, misses: int):
+        self.events.append(("width_lookups", (hits, misses)))
+
+
+def replay(events):
+    for event, args in events:
+        for hook in hooks:
+            getattr(hook, event)(*args)
+
+
+class Profiler(Hook):
+    '''Time and call count of every stage, in total and per song'''
+    def __init__(self):
+        self.totals: Dict[str, List] = {}
+        self.songs: Dict[str, Dict[str, List]] = {}
+        self.pages: Dict[str, int] = {}
+        self.width_hits = 0
+        self.width_misses = 0
+
+    def stage(self, name: str, song: str | None, seconds: float):
+        total = self.totals.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+        if song is not None:
+            per_song = self.songs.setdefault(song, {}).setdefault(name, [0.0, 0])
+            per_song[0] += seconds
+            per_song[1] += 1
+
+    def song_laid_out(self, song: str, pages: int):
+        self.pages[song] = pages
+
+    def width_lookups(self, hits: int, misses: int):
+        self.width_hits += hits
+        self.width_misses += misses
+
+    def song_seconds(self, song: str) -> float:
+        return sum(seconds for seconds, _ in self.songs[song].values())
+
+    def report(self, slowest: int = 10) -> str:
+        lines = ["Stage          calls   total [s]   per call [ms]"]
+        for name, (seconds, calls) in self.totals.items():
+            lines.append(f"{name:<12} {calls:>7} {seconds:>11.3f} {1000 * seconds / calls:>15.3f}")
+
+        lines.append("Slowest songs:")
+        for song in sorted(self.songs, key=self.song_seconds, reverse=True)[:slowest]:
+            stages = ", ".join(f"{name} {1000 * seconds:.1f}" for name, (seconds, _) in self.songs[song].items())
+            lines.append(f"  {song}: {1000 * self.song_seconds(song):.1f} ms ({stages})")
+
+        lookups = self.width_hits + self.width_misses
+        hit_rate = 100 * self.width_hits / lookups if lookups else 0
+        lines.append(f"Width cache: {self.width_hits} hits, {self.width_misses} misses ({hit_rate:.1f}% hit rate)")
+
+        multi_page = [(song, pages) for song, pages in self.pages.items() if pages > 1]
+        lines.append(f"Songs on more than one page ({len(multi_page)}):")
+        for song, pages in multi_page:
+            lines.append(f"  {song}: {pages} pages")
+        return "\n".join(lines)
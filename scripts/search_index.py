@@ -0,0 +1,143 @@
+import argparse
+import json
+import re
+import unicodedata
+from typing import Dict, Iterable, List
+
+from song import Song, sort_songs
+from song_loader import load_songs, resolve_patterns
+from transpose import chord_separator_regex, split_chord_token
+
+INDEX_VERSION = 1
+
+word_regex = re.compile(r"\w+")
+# Letters which do not decompose into a base letter and a combining mark
+fold_table = str.maketrans({"ł": "l", "Ł": "l", "ß": "ss"})
+
+
+def fold(text: str) -> str:
+    '''Lowercase and strip diacritics, so "Żółć" matches "zolc"'''
+    text = unicodedata.normalize("NFKD", text.translate(fold_table).lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    return word_regex.findall(fold(text))
+
+
+def song_chords(song: Song) -> List[str]:
+    '''Distinct chord names of a song in order of appearance, [comments] left out'''
+    chords = {}
+    for paragraph in song.paragraphs:
+        for line in paragraph.chords_lines:
+            for token in chord_separator_regex.split(line)[::2]:
+                if token and split_chord_token(token) is not None:
+                    chords[token.strip("()")] = None
+    return list(chords)
+
+
+def build_index(paths: Iterable[str]) -> dict:
+    songs = load_songs(paths)
+    sort_songs(songs)
+
+    entries = []
+    postings = {"words": {}, "titles": {}, "authors": {}, "chords": {}}
+
+    def add(kind: str, keys: Iterable[str], song_id: int):
+        for key in dict.fromkeys(keys):
+            postings[kind].setdefault(key, []).append(song_id)
+
+    for song_id, song in enumerate(songs):
+        chords = song_chords(song)
+        entries.append({"title": song.title, "author": song.author, "file": song.source.filename,
+                        "line": song.source.line, "offset": song.source.offset, "length": song.source.length,
+                        "chord_count": len(chords)})
+        add("words", (token for paragraph in song.paragraphs for token in tokenize(paragraph.lyrics)), song_id)
+        add("titles", tokenize(song.title), song_id)
+        add("authors", tokenize(song.author or ""), song_id)
+        add("chords", chords, song_id)
+    return {"version": INDEX_VERSION, "songs": entries, **postings}
+
+
+class SearchIndex:
+    '''Queries over an index written by build_index, without touching the songs'''
+    def __init__(self, data: dict):
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported search index version {data.get('version')}")
+        self.songs = data["songs"]
+        self.words = data["words"]
+        self.titles = data["titles"]
+        self.authors = data["authors"]
+        self.chords = data["chords"]
+
+    def load(path: str) -> 'SearchIndex':
+        with open(path, "r", encoding="utf-8") as file:
+            return SearchIndex(json.load(file))
+
+    def lookup(self, postings: Dict[str, List[int]], text: str) -> List[dict]:
+        '''Songs containing all words of the text'''
+        ids = None
+        for token in tokenize(text):
+            found = set(postings.get(token, ()))
+            ids = found if ids is None else ids & found
+        return [self.songs[song_id] for song_id in sorted(ids or ())]
+
+    def songs_with_words(self, text: str) -> List[dict]:
+        return self.lookup(self.words, text)
+
+    def songs_with_title(self, text: str) -> List[dict]:
+        return self.lookup(self.titles, text)
+
+    def songs_by_author(self, text: str) -> List[dict]:
+        return self.lookup(self.authors, text)
+
+    def songs_playable_with(self, chords: Iterable[str]) -> List[dict]:
+        '''Songs with chords whose every chord is in the given set'''
+        known = {}
+        for chord in set(chords):
+            for song_id in self.chords.get(chord, ()):
+                known[song_id] = known.get(song_id, 0) + 1
+        return [self.songs[song_id] for song_id in sorted(known) if known[song_id] == self.songs[song_id]["chord_count"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or query the full-text and chord search index of the songbook."
+    )
+    parser.add_argument('--index', default='search_index.json', help="Index file (default: search_index.json)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Index .fasta files")
+    build_parser.add_argument('input_files', nargs='*', default=['songs/*.fasta'], help="Path to .fasta files (default: songs/*.fasta)")
+
+    for command, description in (("words", "Songs containing all the words"), ("title", "Songs with the words in the title"),
+                          ("author", "Songs by the author"), ("chords", "Songs playable with only these chords")):
+        query_parser = subparsers.add_parser(command, help=description)
+        query_parser.add_argument('terms', nargs='+')
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = build_index(resolve_patterns(args.input_files))
+        with open(args.index, "w", encoding="utf-8") as file:
+            json.dump(index, file, ensure_ascii=False, separators=(",", ":"))
+        print(f"Indexed {len(index['songs'])} songs into {args.index}")
+        return
+
+    index = SearchIndex.load(args.index)
+    text = " ".join(args.terms)
+    if args.command == "words":
+        results = index.songs_with_words(text)
+    elif args.command == "title":
+        results = index.songs_with_title(text)
+    elif args.command == "author":
+        results = index.songs_by_author(text)
+    else:
+        results = index.songs_playable_with(args.terms)
+    for song in results:
+        author = f' – {song["author"]}' if song["author"] is not None else ""
+        print(f'{song["title"]}{author}\t({song["file"]}:{song["line"]})')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,60 @@
+from functools import cache
+import hashlib
+import io
+import locale
 import re
-from typing import List
+import sys
+from typing import Iterator, List, Sequence
+
+# Comment lines that control page breaking before the next paragraph
+PAGE_BREAK_DIRECTIVES = {True: "#!break", False: "#!nobreak"}
 
 class Paragraph:
-    def __init__(self, type: str, lyrics: str, chords: str):
-        self.type = type
-        self.lyrics = lyrics 
-        self.chords = chords
+    '''Lyrics and chords are kept as one string each (separate line strings take
+    almost twice the memory), chord blocks repeat a lot so they are interned.'''
+    __slots__ = ("type", "lyrics", "chords", "line_count", "page_break")
+
+    def __init__(self, type: str, lyrics: str | Sequence[str], chords: str | Sequence[str], page_break: bool | None = None):
+        self.type = sys.intern(type)
+        self.lyrics = lyrics if isinstance(lyrics, str) else "\n".join(lyrics)
+        self.chords = sys.intern(chords if isinstance(chords, str) else "\n".join(chords))
+        self.line_count = self.lyrics.count("\n") + 1
+        # True forces a page break before the paragraph, False forbids it
+        self.page_break = page_break
+
+    @property
+    def lyrics_lines(self) -> List[str]:
+        return self.lyrics.split("\n")
+
+    @property
+    def chords_lines(self) -> List[str]:
+        return self.chords.split("\n")
     
     def __repr__(self):
         return(f"Paragraph:\ntype={self.type}\nlyrics:\n{self.lyrics}\nchords:\n{self.chords}\n")
 
+class SourceSpan:
+    '''Where the text of a song is in its source file (offset and length in bytes)'''
+    __slots__ = ("filename", "line", "offset", "length")
+
+    def __init__(self, filename: str | None, line: int, offset: int, length: int):
+        self.filename = filename
+        self.line = line
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return f"{self.filename}:{self.line} (bytes {self.offset}-{self.offset + self.length})"
+
+
 class Song:
-    def __init__(self, title: str, author: str, paragraphs: List[Paragraph]):
+    __slots__ = ("title", "author", "paragraphs", "source")
+
+    def __init__(self, title: str, author: str, paragraphs: Sequence[Paragraph], source: SourceSpan | None = None):
         self.title = title
         self.author = author
-        self.paragraphs = paragraphs
+        self.paragraphs = tuple(paragraphs)
+        self.source = source
 
     def __repr__(self) -> str:
         data = ""
@@ -23,69 +63,169 @@ class Song:
             data += f" | {self.author}"
         data += f"\n\n"
         for paragraph in self.paragraphs:
-            lyrics_lines = paragraph.lyrics.split("\n")
-            chords_lines = paragraph.chords.split("\n")
+            if paragraph.page_break is not None:
+                data += f"{PAGE_BREAK_DIRECTIVES[paragraph.page_break]}\n"
             max_line_len = 0
-            for line in lyrics_lines:
+            for line in paragraph.lyrics_lines:
                 if len(line) > max_line_len:
                     max_line_len = len(line)
-            for lyrics_line, chords_line in zip(lyrics_lines, chords_lines):
+            for lyrics_line, chords_line in zip(paragraph.lyrics_lines, paragraph.chords_lines):
                 lyric = lyrics_line if len(lyrics_line) > 0 else "-"
                 chords = f" | {chords_line}" if chords_line != "" else ""
                 data += f"{' '*8 if paragraph.type == 'chorus' else ''}{lyric.ljust(max_line_len+4)}{chords}\n"
             data += "\n"
         return data
+
+    def content_hash(self) -> str:
+        '''Hash of everything that affects how the song is typeset'''
+        h = hashlib.sha256()
+        h.update(f"{self.title}\0{self.author}\0".encode())
+        for paragraph in self.paragraphs:
+            h.update(f"{paragraph.type}\0{paragraph.lyrics}\0{paragraph.chords}\0{paragraph.page_break}\0".encode())
+        return h.hexdigest()
     
-    def load_from_fasta(data: str) -> List['Song']:
-        songs = []
+    def load_from_fasta(data) -> List['Song']:
+        return list(Song.iter_from_fasta(data))
 
-        datalines = data.split("\n")
-        data = "\n".join(filter(lambda x: not x.strip().startswith("#"), datalines))
+    def iter_from_fasta(source, filename: str | None = None, first_line: int = 1, offset: int = 0) -> Iterator['Song']:
+        '''Parses songs from a string, a file object or any iterable of lines.
 
-        blocks = data.split(">")
+        The input is read in a single pass and every song is yielded as soon as
+        the next header (or the end of input) is reached. A song header is a line
+        starting with ">", lines starting with "#" are comments and paragraphs are
+        separated by empty lines. "#!break" and "#!nobreak" force or forbid a page
+        break before the following paragraph, other "#!" lines are comments.
 
-        if len(blocks) <= 1: # There are no songs in the file
-            return songs
+        Every song records its SourceSpan. Byte offsets are exact when the lines
+        keep their line endings, e.g. for files opened in binary mode (lines may
+        be bytes, they are decoded as UTF-8). first_line and offset give the position
+        of the source in the file when it is only a part of it.'''
+        if isinstance(source, str):
+            source = io.StringIO(source)
 
-        for block in blocks[1:]:
-            first_line = block.split("\n")[0]
-            if "|" in first_line:
-                title, author = [value.strip() for value in first_line.split("|")]
+        parser = _FastaParser(filename)
+        for lineno, line in enumerate(source, first_line):
+            if isinstance(line, bytes):
+                size = len(line)
+                line = line.decode("utf-8")
             else:
-                title, author = first_line.strip(), None
-
-            paragraphs = []
-            lyrics_lines = "\n".join(block.strip().split("\n")[1:]).lstrip("\n")
-            single_paragraph_blocks = lyrics_lines.split("\n\n")
-            for block in single_paragraph_blocks:
-                if block == "":
-                    continue
-                lines = block.split("\n")
-                paragraph_type = "chorus" if re.match(r'\s', lines[0]) else "verse"
-                lyrics, chords = [], []
-                for line in lines:
-                    if "|" in line:
-                        text, chord = line.split("|")
-                        lyrics.append(text.strip())
-                        chords.append(chord.strip())
-                    else:
-                        lyrics.append(line.strip())
-                        chords.append("")
-                for i in range(len(lyrics)):
-                    if lyrics[i] == "-":
-                        lyrics[i] = ""
-                lyrics = "\n".join(lyrics)
-                chords = "\n".join(chords)
-                paragraphs.append(Paragraph(paragraph_type, lyrics, chords))
-
-            songs.append(Song(title, author, paragraphs))
-            
-        return songs
-    
+                size = len(line) if line.isascii() else len(line.encode("utf-8"))
+            song = parser.feed(line.rstrip("\r\n"), lineno, offset)
+            offset += size
+            if song is not None:
+                yield song
+        song = parser.finish(offset)
+        if song is not None:
+            yield song
 
-    
-        
-    
+
+class FastaParseError(ValueError):
+    def __init__(self, message: str, line: int, column: int, filename: str | None = None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+        self.column = column
+        self.filename = filename
+
+    def __str__(self):
+        return f"{self.filename or '<fasta>'}:{self.line}:{self.column}: {self.message}"
+
+
+class _FastaParser:
+    '''Line-by-line state machine behind Song.iter_from_fasta'''
+    def __init__(self, filename: str | None):
+        self.filename = filename
+        self.title = None
+        self.author = None
+        self.start = None
+        self.paragraphs = []
+        self.lines = []
+        self.paragraph_ended = False
+        self.page_break = None
+        self.next_page_break = None
+
+    def feed(self, line: str, lineno: int, offset: int) -> Song | None:
+        if line.strip().startswith("#!"):
+            self.directive(line.strip(), lineno)
+            return None
+        if line.strip().startswith("#"):
+            return None
+        if line.startswith(">"):
+            song = self.finish(offset)
+            self.title, self.author = self.split_line(line[1:], lineno, 2)
+            self.start = (lineno, offset)
+            return song
+        if self.title is None:
+            # Text before the first header is ignored
+            return None
+        if line == "":
+            self.paragraph_ended = bool(self.lines)
+        elif line.strip() != "" or self.lines or self.paragraphs:
+            if self.paragraph_ended:
+                self.end_paragraph()
+            if not self.lines:
+                self.page_break, self.next_page_break = self.next_page_break, None
+            self.lines.append((line, lineno))
+        return None
+
+    def finish(self, offset: int) -> Song | None:
+        if self.title is None:
+            return None
+        # Whitespace-only lines at the end of a song are not part of it
+        while self.lines and self.lines[-1][0].strip() == "":
+            self.lines.pop()
+        self.end_paragraph()
+        line, start = self.start
+        song = Song(self.title, self.author, self.paragraphs, SourceSpan(self.filename, line, start, offset - start))
+        self.title, self.author, self.paragraphs = None, None, []
+        self.next_page_break = None
+        return song
+
+    def end_paragraph(self):
+        if not self.lines:
+            return
+        paragraph_type = "chorus" if re.match(r'\s', self.lines[0][0]) else "verse"
+        lyrics, chords = [], []
+        for line, lineno in self.lines:
+            text, chord = self.split_line(line, lineno, 1)
+            lyrics.append("" if text == "-" else text)
+            chords.append(chord or "")
+        self.paragraphs.append(Paragraph(paragraph_type, lyrics, chords, self.page_break))
+        self.lines = []
+        self.paragraph_ended = False
+
+    def directive(self, directive: str, lineno: int):
+        # Any other "#!" line is an ordinary comment
+        for page_break, name in PAGE_BREAK_DIRECTIVES.items():
+            if directive == name:
+                self.next_page_break = page_break
+                return
+
+    def split_line(self, line: str, lineno: int, column: int):
+        '''Splits a "left | right" line, right is None when there is no separator'''
+        separator = line.find("|")
+        if separator < 0:
+            return line.strip(), None
+        extra = line.find("|", separator+1)
+        if extra >= 0:
+            raise FastaParseError("unexpected second '|' separator", lineno, column+extra, self.filename)
+        return line[:separator].strip(), line[separator+1:].strip()
+
+@cache
+def setup_collation():
+    '''Switches string collation to Polish, done once before the first sort'''
+    try:
+        locale.setlocale(locale.LC_COLLATE, 'pl_PL.UTF-8')
+    except locale.Error:
+        print("Locale not supported on this system.")
+
+
+def sort_songs(songs : List[Song]):
+    setup_collation()
+    try:
+        songs.sort(key=lambda x: locale.strxfrm(x.title.replace(" ", "")))
+    except AttributeError:
+        songs.sort(key=lambda x: locale.strxfrm(x["title"].replace(" ", "")))
 
 
 if __name__=="__main__":
@@ -0,0 +1,71 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+from song import Song
+
+
+def resolve_patterns(patterns: Iterable[str]) -> List[str]:
+    '''Expands file names and glob patterns into existing files.
+
+    Files come in the order of the patterns, sorted within a pattern, and a
+    file matched by several patterns (or through a symlink) is kept only the
+    first time.'''
+    filenames = []
+    seen = set()
+    for pattern in patterns:
+        # glob.glob handles cases where the shell might not expand the *
+        for filename in sorted(glob.glob(pattern)):
+            real_path = os.path.realpath(filename)
+            if real_path in seen or not os.path.isfile(filename):
+                continue
+            seen.add(real_path)
+            filenames.append(filename)
+    return filenames
+
+
+def read_file(filename: str) -> bytes:
+    with open(filename, "rb") as file:
+        return file.read()
+
+
+def parse_file(filename: str, data: bytes) -> List[Song]:
+    # Lines are kept as bytes, so the source offsets of the songs are exact
+    return list(Song.iter_from_fasta(data.splitlines(keepends=True), filename))
+
+
+def load_song_files(patterns: Iterable[str], jobs: int = 1) -> List[Tuple[str, List[Song]]]:
+    '''Songs of every file matched by the patterns, as (filename, songs) pairs.
+
+    Files are read concurrently and parsed in a pool of jobs processes, the
+    result is in the order of resolve_patterns whatever the number of jobs.'''
+    filenames = resolve_patterns(patterns)
+    if not filenames:
+        return []
+    with ThreadPoolExecutor(min(32, len(filenames))) as threads:
+        contents = list(threads.map(read_file, filenames))
+    if jobs > 1 and len(filenames) > 1:
+        with ProcessPoolExecutor(min(jobs, len(filenames))) as pool:
+            songs = list(pool.map(parse_file, filenames, contents))
+    else:
+        songs = [parse_file(filename, data) for filename, data in zip(filenames, contents)]
+    return list(zip(filenames, songs))
+
+
+def load_songs(patterns: Iterable[str], jobs: int = 1) -> List[Song]:
+    return [song for _, songs in load_song_files(patterns, jobs) for song in songs]
+
+
+def duplicate_titles(songs: Iterable[Song]) -> Dict[str, List[Song]]:
+    '''Songs sharing a title (compared case-insensitively), by title'''
+    by_title = {}
+    for song in songs:
+        by_title.setdefault(song.title.strip().casefold(), []).append(song)
+    return {same[0].title: same for same in by_title.values() if len(same) > 1}
+
+
+def report_duplicate_titles(songs: Iterable[Song]):
+    for title, same in duplicate_titles(songs).items():
+        places = ", ".join(f"{song.source.filename}:{song.source.line}" for song in same if song.source is not None)
+        print(f"Warning: {len(same)} songs titled {title!r} ({places})")
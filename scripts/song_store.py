@@ -0,0 +1,54 @@
+import json
+import mmap
+from typing import Dict, List
+
+from song import Song
+
+
+class SongStore:
+    '''Random access to single songs through song_manifest.json.
+
+    The manifest gives the byte offset and length of every song in its .fasta
+    file, the files are memory-mapped and only the requested songs are parsed,
+    so loading one song costs the same however big the catalogue is.'''
+    def __init__(self, entries: List[dict]):
+        self.entries = entries
+        self.by_title = {}
+        for entry in entries:
+            self.by_title.setdefault(entry["title"], entry)
+        self.maps: Dict[str, mmap.mmap] = {}
+
+    def load(path: str = "song_manifest.json") -> 'SongStore':
+        with open(path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        if "songs" not in manifest:
+            raise ValueError(f"{path} has no song offsets, rebuild it with build_song_index.py")
+        return SongStore(manifest["songs"])
+
+    def file_map(self, filename: str) -> mmap.mmap:
+        data = self.maps.get(filename)
+        if data is None:
+            with open(filename, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[filename] = data
+        return data
+
+    def song(self, entry: dict) -> Song:
+        '''Parses the song of a manifest entry, checking it against the recorded hash'''
+        offset, length = entry["offset"], entry["length"]
+        text = self.file_map(entry["file"])[offset:offset + length]
+        songs = list(Song.iter_from_fasta(text.splitlines(keepends=True), entry["file"], entry["line"], offset))
+        if len(songs) != 1 or songs[0].content_hash() != entry["hash"]:
+            raise ValueError(f"{entry['file']} changed since the manifest was built, rebuild it with build_song_index.py")
+        return songs[0]
+
+    def song_by_title(self, title: str) -> Song:
+        entry = self.by_title.get(title)
+        if entry is None:
+            raise KeyError(f"No song titled {title!r} in the manifest")
+        return self.song(entry)
+
+    def close(self):
+        for data in self.maps.values():
+            data.close()
+        self.maps.clear()
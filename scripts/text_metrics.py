@@ -0,0 +1,33 @@
+from functools import lru_cache
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+# Font name -> (glyph advance lookup in font units, default advance)
+glyph_tables = {}
+
+
+def glyph_table(font_name: str):
+    '''Returns the glyph advance table of a registered font, building it on first use'''
+    table = glyph_tables.get(font_name)
+    if table is None:
+        font = pdfmetrics.getFont(font_name)
+        if isinstance(font, TTFont):
+            table = (dict(font.face.charWidths).get, font.face.defaultWidth)
+        glyph_tables[font_name] = table
+    return table
+
+
+@lru_cache(maxsize=16384)
+def string_width(text: str, font_name: str, font_size: float) -> float:
+    '''Width of a string in points.
+
+    Gives exactly the same result as pdfmetrics.stringWidth: advances are summed
+    in font units and scaled once, so cached layouts and rendering stay
+    byte-identical.'''
+    table = glyph_table(font_name)
+    if table is None:
+        return pdfmetrics.stringWidth(text, font_name, font_size)
+    advance, default = table
+    return 0.001*font_size*sum(advance(ord(char), default) for char in text)
+
@@ -1,57 +1,166 @@
 #! /usr/bin/python
 
-import sys
+import argparse
 import re
+from typing import Iterable, List
 
-if len(sys.argv) != 3:
-    print("Usage: transpose.py <half-steps> <chord sequence>\nExample: transpose.py +4 \"C D e\"")
-    exit(-1)
+from song import Paragraph, Song
 
-valid_chord_regex = r'^[a-hA-H](#|b)?[a-zA-Z0-9]*'
-chord_name_regex = r'^[a-hA-H](#|b)?'
-
-def chordname_split(chordname: str):
-    if re.match(valid_chord_regex, chordname) is None:
-        raise ValueError(f"{chordname} is not a valid chord name")
-    match = re.match(chord_name_regex, chordname)
-    return chordname[match.span()[0]:match.span()[1]], chordname[match.span()[1]:]
+# A chord token: optional brackets, root note with accidental, suffix (sus4,
+# add9, 7, +, ...) and an optional slash bass note, e.g. "a", "C7+", "D/F#", "(A7)"
+chord_token_regex = re.compile(r'(\(?)([a-hA-H])(#|b)?([a-zA-Z0-9+]*?)(?:/([a-hA-H])(#|b)?([a-zA-Z0-9+]*))?(\)?)')
+# Comments like [x2] and whitespace are kept as they are
+chord_separator_regex = re.compile(r'(\[[^\[\]]*\]|\s+)')
 
 note_steps = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 10, "h": 11}
+accidental_steps = {None: 0, "#": 1, "b": -1}
+step_notes = "c c# d d# e f f# g g# a b h".split(" ")
+# note_names[uppercase][step]
+note_names = (step_notes, [note.upper() for note in step_notes])
+# transpose_tables[steps] maps every pitch byte to the pitch transposed by steps
+transpose_tables = [bytes((i + steps) % 12 if i < 12 else i for i in range(256)) for steps in range(12)]
 
-def note_to_chromatic_scale(note: str):
-    note = note.lower()
-    step = note_steps[note[0]]
-    if len(note) == 2:
-        if note[1] == "#":
-            step += 1
-        elif note[1] == "b":
-            step -= 1
-    return step
 
-step_notes = "c c# d d# e f f# g g# a b h".split(" ")
+def note_to_chromatic_scale(note: str, accidental: str | None = None):
+    return (note_steps[note.lower()] + accidental_steps[accidental]) % 12
+
+
+def split_chord_token(token: str):
+    '''Splits a chord token into literal text and (step, uppercase) notes.
+
+    Returns a list alternating literals and notes, starting and ending with a
+    literal, or None when the token is not a valid chord.'''
+    match = chord_token_regex.fullmatch(token)
+    if match is None:
+        return None
+    opening, root, accidental, suffix, bass, bass_accidental, bass_suffix, closing = match.groups()
+    parts = [opening, (note_to_chromatic_scale(root, accidental), root.isupper())]
+    if bass is None:
+        parts.append(suffix + closing)
+    else:
+        parts.extend([suffix + "/", (note_to_chromatic_scale(bass, bass_accidental), bass.isupper()), bass_suffix + closing])
+    return parts
+
+
+def invalid_chord_tokens(line: str) -> List[str]:
+    '''Tokens of a chord line which are neither chords nor [comments]'''
+    tokens = chord_separator_regex.split(line)
+    return [token for token in tokens[::2] if token != "" and split_chord_token(token) is None]
+
+
+class ChordSheet:
+    '''Chord lines tokenised once: the chord roots of all lines are stored as one
+    byte array of chromatic steps, everything else as literal text around them.
 
-def chromatic_scale_to_note(step: int):
-    return step_notes[step%12]
+    Transposing is then a single table lookup over the whole array
+    (bytes.translate), however many songs the sheet holds.'''
+    def __init__(self, literals: List[str], note_counts: List[int], steps: bytes, uppercase: bytes):
+        # Per line: one literal before each note and one after the last note
+        self.literals = literals
+        self.note_counts = note_counts
+        self.steps = steps
+        self.uppercase = uppercase
 
-def note_transpose(note: str, steps: int):
-    step = note_to_chromatic_scale(note)
-    step += steps
-    new_note = chromatic_scale_to_note(step)
-    if note[0].isupper():
-        new_note = new_note.upper()
-    return new_note
+    def from_lines(lines: Iterable[str]) -> 'ChordSheet':
+        literals, note_counts = [], []
+        steps, uppercase = bytearray(), bytearray()
+        for line in lines:
+            count = 0
+            literal = ""
+            for i, token in enumerate(chord_separator_regex.split(line)):
+                parts = None if i % 2 else split_chord_token(token)
+                if parts is None:
+                    literal += token
+                    continue
+                for j, part in enumerate(parts):
+                    if j % 2 == 0:
+                        literal += part
+                    else:
+                        literals.append(literal)
+                        literal = ""
+                        steps.append(part[0])
+                        uppercase.append(part[1])
+                        count += 1
+            literals.append(literal)
+            note_counts.append(count)
+        return ChordSheet(literals, note_counts, bytes(steps), bytes(uppercase))
 
+    def transposed(self, steps: int) -> 'ChordSheet':
+        return ChordSheet(self.literals, self.note_counts, self.steps.translate(transpose_tables[steps % 12]), self.uppercase)
 
-steps = int(sys.argv[1])
-chords = sys.argv[2].split(" ")
+    def lines(self) -> List[str]:
+        notes = [note_names[upper][step] for step, upper in zip(self.steps, self.uppercase)]
+        lines = []
+        literal_idx = 0
+        note_idx = 0
+        for count in self.note_counts:
+            parts = []
+            for literal, note in zip(self.literals[literal_idx:literal_idx+count], notes[note_idx:note_idx+count]):
+                parts.append(literal)
+                parts.append(note)
+            parts.append(self.literals[literal_idx+count])
+            literal_idx += count + 1
+            note_idx += count
+            lines.append("".join(parts))
+        return lines
 
 
-try:
+def transpose_chord_line(line: str, steps: int) -> str:
+    return ChordSheet.from_lines([line]).transposed(steps).lines()[0]
+
+
+def transpose_songs(songs: List[Song], steps: int) -> List[Song]:
+    '''Transposes the chords of all songs at once, lyrics and [comments] are kept'''
+    if steps % 12 == 0:
+        # Keep the original spelling (e.g. A# stays A#, not B)
+        return list(songs)
+    sheet = ChordSheet.from_lines(line for song in songs for paragraph in song.paragraphs for line in paragraph.chords_lines)
+    transposed_lines = iter(sheet.transposed(steps).lines())
     transposed = []
-    for chord in chords:
-        note, type = chordname_split(chord)
-        transposed.append(note_transpose(note, steps) + type)
-    print(" ".join(transposed))
-except Exception as e:
-    print("Error:", e)
+    for song in songs:
+        paragraphs = []
+        for paragraph in song.paragraphs:
+            chords = [next(transposed_lines) for _ in paragraph.chords_lines]
+            paragraphs.append(Paragraph(paragraph.type, paragraph.lyrics_lines, chords, paragraph.page_break))
+        transposed.append(Song(song.title, song.author, paragraphs))
+    return transposed
+
+
+def transpose_song(song: Song, steps: int) -> Song:
+    return transpose_songs([song], steps)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transpose chords by a number of half-steps.",
+        epilog="Example: transpose.py +4 \"C D e\""
+    )
+    parser.add_argument('steps', type=int, help="Number of half-steps, e.g. +4 or -2")
+    parser.add_argument('chords', nargs='?', help="Chord sequence to transpose")
+    parser.add_argument(
+        '--fasta',
+        nargs='+',
+        default=[],
+        help="Transpose whole .fasta files and print the result"
+    )
+    args = parser.parse_args()
+
+    if args.chords is None and not args.fasta:
+        parser.error("give a chord sequence or --fasta files")
+
+    if args.chords is not None:
+        invalid = invalid_chord_tokens(args.chords)
+        if invalid:
+            print("Error:", f"{invalid[0]} is not a valid chord name")
+            exit(-1)
+        print(transpose_chord_line(args.chords, args.steps))
+
+    for filename in args.fasta:
+        with open(filename, 'r', encoding='utf-8') as f:
+            songs = transpose_songs(Song.load_from_fasta(f), args.steps)
+        for song in songs:
+            print(song)
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import compile
+from compile import config
+from song import FastaParseError, Song
+from song_loader import duplicate_titles, parse_file, read_file, resolve_patterns
+from text_metrics import string_width
+from transpose import invalid_chord_tokens
+
+STATE_VERSION = 2
+
+
+def song_issues(song: Song) -> List[dict]:
+    '''Bad chord tokens and lines running off the page (on either side of the
+    bind, pages are shifted by config.page_bind_offset) of one song.
+
+    Positions are given as paragraph and line numbers within the song, counted
+    from 1.'''
+    issues = []
+    for par_idx, paragraph in enumerate(song.paragraphs, 1):
+        for line_idx, line in enumerate(paragraph.chords_lines, 1):
+            for token in invalid_chord_tokens(line):
+                issues.append({"kind": "chord", "paragraph": par_idx, "line": line_idx,
+                               "message": f"{token!r} is not a valid chord name"})
+
+    # Laid out page by page like compile.py does, each page is centred on its
+    # own widest paragraph
+    W = config.page_size[0]
+    usable_width = W - 2*config.page_bind_offset
+    par_idx = 0
+    for placement in compile.compile_single_song(song):
+        for par, chords_x in zip(placement.parblocks, placement.chords_x_list):
+            par_idx += 1
+            if par.total_width > usable_width:
+                issues.append({"kind": "overflow", "paragraph": par_idx, "line": None,
+                               "message": f"paragraph is {par.total_width:.0f} pt wide, {par.total_width - usable_width:.0f} pt wider than the page"})
+                continue
+            for line_idx, chords in enumerate(par.chords_lines, 1):
+                right = chords_x + string_width(chords, config.font_chords.name, config.font_chords.size) + config.page_bind_offset
+                if right > W:
+                    issues.append({"kind": "overflow", "paragraph": par_idx, "line": line_idx,
+                                   "message": f"line ends {right - W:.0f} pt past the page edge"})
+    return issues
+
+
+def load_state(path: str) -> dict:
+    '''Issues of every song validated before, by content hash. The state is
+    dropped when the layout config (which the overflow check depends on)
+    changed.'''
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if state.get("version") != STATE_VERSION or state.get("config") != compile.config_fingerprint(config):
+        return {}
+    return state["songs"]
+
+
+def save_state(path: str, songs: dict):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"version": STATE_VERSION, "config": compile.config_fingerprint(config), "songs": songs}, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def validate(patterns: List[str], state_path: str | None, jobs: int = 1) -> dict:
+    '''Validates the songs whose content hash is not in the state file and
+    returns the report of the whole corpus: issues (those of unchanged songs
+    come from the state), parse errors, duplicate titles and which songs
+    changed or were removed since the state was saved.'''
+    songs, errors = [], []
+    for filename in resolve_patterns(patterns):
+        try:
+            songs.extend(parse_file(filename, read_file(filename)))
+        except (OSError, UnicodeDecodeError, FastaParseError) as e:
+            errors.append({"file": filename, "line": getattr(e, "line", None), "message": str(e)})
+
+    previous = load_state(state_path) if state_path is not None else {}
+    hashes = [song.content_hash() for song in songs]
+    changed = {}
+    for song, song_hash in zip(songs, hashes):
+        if song_hash not in previous:
+            changed.setdefault(song_hash, song)
+
+    changed_songs = list(changed.values())
+    if jobs > 1 and len(changed_songs) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(song_issues, changed_songs, chunksize=max(1, len(changed_songs) // (4*jobs))))
+    else:
+        results = [song_issues(song) for song in changed_songs]
+    known = {song_hash: previous[song_hash] for song_hash in hashes if song_hash in previous}
+    known.update(zip(changed, results))
+
+    issues = []
+    for song, song_hash in zip(songs, hashes):
+        for issue in known[song_hash]:
+            issues.append({"file": song.source.filename, "song_line": song.source.line, "title": song.title, **issue})
+    duplicates = [{"title": title, "places": [f"{song.source.filename}:{song.source.line}" for song in same]}
+                  for title, same in duplicate_titles(songs).items()]
+
+    if state_path is not None and not errors:
+        save_state(state_path, known)
+    return {"songs": len(songs),
+            "changed": [{"title": song.title, "file": song.source.filename, "line": song.source.line} for song in changed_songs],
+            "removed": len(set(previous) - set(hashes)),
+            "parse_errors": errors, "issues": issues, "duplicate_titles": duplicates}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the songs for parse errors, bad chord names, lines wider than the page and duplicate titles."
+    )
+    parser.add_argument('input_files', nargs='*', default=['songs/*.fasta'], help="Path to .fasta files (default: songs/*.fasta)")
+    parser.add_argument(
+        '--state',
+        default='.cache/validate.json',
+        help="Content hashes and issues of validated songs, only songs not in it are checked (default: .cache/validate.json)"
+    )
+    parser.add_argument('--no-state', action='store_true', help="Check every song and do not write the state file")
+    parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: all CPUs)")
+    parser.add_argument('--strict', action='store_true', help="Exit with status 1 when anything is reported")
+    args = parser.parse_args()
+
+    report = validate(args.input_files, None if args.no_state else args.state, args.jobs)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=1)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+    print(f"{report['songs']} songs, {len(report['changed'])} changed, {report['removed']} removed: "
+          f"{len(report['parse_errors'])} parse errors, {len(report['issues'])} issues, "
+          f"{len(report['duplicate_titles'])} duplicate titles", file=sys.stderr)
+    if args.strict and (report["parse_errors"] or report["issues"] or report["duplicate_titles"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import time
+from typing import Dict, List, Tuple
+
+import compile
+from layout_cache import MemoryLayoutCache
+from song import FastaParseError, Song, sort_songs
+from song_loader import parse_file, read_file, resolve_patterns
+from transpose import transpose_songs
+
+
+class SongbookWatcher:
+    '''Keeps the parsed songs and their layouts in memory and rebuilds the pdf
+    whenever a .fasta file matching the patterns changes.
+
+    Only changed files are parsed again and only songs whose content changed
+    are laid out again. With a preview path, just the changed songs are
+    written there instead of rebuilding the whole book.'''
+    def __init__(self,
+                 patterns: List[str],
+                 output_path: str,
+                 cache: MemoryLayoutCache,
+                 transpose: int = 0,
+                 preview_path: str | None = None,
+                 extra_targets=(),
+                 jobs: int = 1,
+                 pack: bool = False):
+        self.patterns = patterns
+        self.output_path = output_path
+        self.cache = cache
+        self.transpose = transpose
+        self.preview_path = preview_path
+        self.extra_targets = extra_targets
+        self.jobs = jobs
+        self.pack = pack
+        # filename -> ((mtime, size), songs)
+        self.files: Dict[str, Tuple[Tuple[int, int], List[Song]]] = {}
+        # filename -> (mtime, size) of a version which failed to parse
+        self.failed: Dict[str, Tuple[int, int]] = {}
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        for filename in resolve_patterns(self.patterns):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            stats[filename] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def update(self) -> List[Song] | None:
+        '''Parses the files changed since the last call. Returns the songs with
+        new content, or None when no file changed.'''
+        stats = self.scan()
+        changed_files = False
+        changed_songs = []
+        for filename in list(self.files):
+            if filename not in stats:
+                del self.files[filename]
+                changed_files = True
+                print(f"Removed {filename}")
+        for filename, stat in stats.items():
+            old = self.files.get(filename)
+            if (old is not None and old[0] == stat) or self.failed.get(filename) == stat:
+                continue
+            try:
+                songs = transpose_songs(parse_file(filename, read_file(filename)), self.transpose)
+            except (OSError, UnicodeDecodeError, FastaParseError) as e:
+                # Keep the last good version while the file is being edited,
+                # parse errors already name the file and position
+                print(f"Error: {e}" if isinstance(e, FastaParseError) else f"Error: {filename}: {e}")
+                self.failed[filename] = stat
+                continue
+            self.failed.pop(filename, None)
+            old_hashes = set() if old is None else {song.content_hash() for song in old[1]}
+            changed_songs.extend(song for song in songs if song.content_hash() not in old_hashes)
+            self.files[filename] = (stat, songs)
+            changed_files = True
+        return changed_songs if changed_files else None
+
+    def songs(self) -> List[Song]:
+        songs = [song for _, file_songs in self.files.values() for song in file_songs]
+        sort_songs(songs)
+        return songs
+
+    def build(self, changed_songs: List[Song]):
+        start = time.perf_counter()
+        self.cache.hits = self.cache.misses = 0
+        if self.preview_path is not None:
+            if not changed_songs:
+                return
+            compile.compile(changed_songs, self.preview_path, self.cache, self.jobs, pack=self.pack)
+            output = self.preview_path
+        else:
+            compile.compile(self.songs(), self.output_path, self.cache, self.jobs, self.extra_targets, self.pack)
+            output = self.output_path
+        print(f"Rebuilt {output} in {time.perf_counter() - start:.2f} s")
+
+    def run(self, interval: float = 0.5):
+        self.update()
+        # The whole book once, later only what changed
+        if self.preview_path is None:
+            self.build([])
+        else:
+            compile.compile(self.songs(), self.output_path, self.cache, self.jobs, self.extra_targets, self.pack)
+        print(f"Watching {', '.join(self.patterns)} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(interval)
+                changed_songs = self.update()
+                if changed_songs is None:
+                    continue
+                if changed_songs:
+                    print(f"Changed: {', '.join(song.title for song in changed_songs)}")
+                self.build(changed_songs)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts import each other as top-level modules and find the footer
+# images relative to the repository root
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+os.chdir(ROOT)
@@ -0,0 +1,126 @@
+import io
+import random
+
+import pytest
+from reportlab import rl_config
+
+import compile
+from compile import PackedPage, ParBlock, TitleParams, compute_page_breaks, config, pack_songs, packed_height, schedule_pages
+from layout_cache import LayoutCache
+from song_loader import load_songs
+from song import sort_songs
+
+
+def par(height: float, page_break=None) -> ParBlock:
+    return ParBlock(["x"], [""], 10, 0, height, 0, page_break)
+
+
+TITLE = TitleParams("Title", None, 0, 0, 0)
+
+
+def test_page_breaks_fit_the_pages():
+    assert compute_page_breaks([par(100) for _ in range(3)], TITLE) == [0]
+    assert compute_page_breaks([par(150) for _ in range(6)], TITLE) == [0, 3]
+
+
+def test_forced_page_break():
+    assert compute_page_breaks([par(100), par(100, True), par(100)], TITLE) == [0, 1]
+
+
+def test_forbidden_page_break():
+    pars = [par(150) for _ in range(6)]
+    pars[3].page_break = False
+    # Three paragraphs fit on a page, so one more page is needed
+    assert compute_page_breaks(pars, TITLE) == [0, 2, 4]
+
+
+def test_forbidden_breaks_everywhere_overflow_one_page():
+    assert compute_page_breaks([par(300)] + [par(300, False) for _ in range(2)], TITLE) == [0]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_multi_page_songs_start_on_even_pages(seed):
+    rng = random.Random(seed)
+    groups = [[(song, page) for page in range(rng.choice([1, 1, 1, 2, 3]))] for song in range(40)]
+    pages = schedule_pages(groups, config.max_reorder_distance)
+    assert sorted(page for page in pages if page is not None) == sorted(page for group in groups for page in group)
+    for group in groups:
+        if len(group) > 1:
+            start = pages.index(group[0])
+            # Page numbers start at 1, so even pages have odd indices
+            assert start % 2 == 1
+            assert pages[start:start + len(group)] == group
+
+
+def render(songs, **kwargs) -> bytes:
+    pdf = io.BytesIO()
+    compile.compile(songs, pdf, **kwargs)
+    return pdf.getvalue()
+
+
+@pytest.fixture(scope="module")
+def songs():
+    songs = load_songs(["songs/szanty.fasta", "songs/kult.fasta"])
+    sort_songs(songs)
+    return songs
+
+
+@pytest.fixture(autouse=True)
+def invariant(monkeypatch):
+    # No timestamps and document ids, so equal pdfs are equal bytes
+    monkeypatch.setattr(rl_config, "invariant", 1)
+
+
+def test_output_does_not_depend_on_jobs(songs):
+    assert render(songs, jobs=1) == render(songs, jobs=2)
+
+
+def test_output_does_not_depend_on_the_layout_cache(songs, tmp_path):
+    uncached = render(songs)
+    cache = LayoutCache(str(tmp_path), compile.config_fingerprint(config))
+    cold = render(songs, cache=cache)
+    assert cache.misses == len(songs)
+    warm_cache = LayoutCache(str(tmp_path), compile.config_fingerprint(config))
+    warm = render(songs, cache=warm_cache)
+    assert warm_cache.hits == len(songs)
+    assert uncached == cold == warm
+
+
+def test_layout_cache_prune_keeps_what_the_build_used(songs, tmp_path):
+    cache = LayoutCache(str(tmp_path), compile.config_fingerprint(config))
+    render(songs, cache=cache)
+    (tmp_path / "stale.json").write_text("[]")
+
+    # A build of some songs only does not prune anything by itself
+    partial_cache = LayoutCache(str(tmp_path), compile.config_fingerprint(config))
+    render(songs[:2], cache=partial_cache)
+    assert len(list(tmp_path.iterdir())) == len(songs) + 1
+
+    cache = LayoutCache(str(tmp_path), compile.config_fingerprint(config))
+    render(songs, cache=cache)
+    assert cache.prune() == 1
+    assert len(list(tmp_path.iterdir())) == len(songs)
+
+
+def test_pack_songs(songs):
+    groups = compile.compile_songs(songs)
+    packed = pack_songs(songs, groups, config.pack_window)
+    assert len(packed) < len(groups)
+
+    order = []
+    for group in packed:
+        if isinstance(group[0], PackedPage):
+            page = group[0]
+            assert len(group) == 1 and len(page.placements) > 1
+            order.extend(songs.index(song) for song, _ in page.sources)
+            last = page.placements[-1]
+            assert last.title_y + packed_height(last) <= config.page_size[1] - config.min_bottom_margin
+        else:
+            order.append(groups.index(group))
+    # Every song once, at most a window away from its place
+    assert sorted(order) == list(range(len(songs)))
+    assert all(abs(position - i) < config.pack_window for position, i in enumerate(order))
+
+
+def test_packed_output_does_not_depend_on_jobs(songs):
+    assert render(songs, pack=True) == render(songs, jobs=2, pack=True)
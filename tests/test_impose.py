@@ -0,0 +1,20 @@
+from impose_a5_to_a4 import booklet_order
+
+
+def test_booklet_order_signatures_of_one_sheet():
+    assert list(booklet_order(8)) == [(3, 0), (1, 2), (7, 4), (5, 6)]
+
+
+def test_booklet_order_saddle_stitched():
+    assert list(booklet_order(8, 0)) == [(7, 0), (1, 6), (5, 2), (3, 4)]
+
+
+def test_booklet_order_pads_with_blank_pages():
+    assert list(booklet_order(5, 0)) == [(None, 0), (1, None), (None, 2), (3, 4)]
+
+
+def test_booklet_order_places_every_page_once():
+    for pages in range(1, 30):
+        for sheets in (0, 1, 2, 3):
+            placed = [idx for side in booklet_order(pages, sheets) for idx in side if idx is not None]
+            assert sorted(placed) == list(range(pages))
@@ -0,0 +1,44 @@
+from search_index import SearchIndex, build_index, fold, song_chords
+from song import Song
+
+
+def write_songs(tmp_path) -> str:
+    path = tmp_path / "songs.fasta"
+    path.write_text("> Żółta łódź | Kowalski\n\nPłynie łódź | C G\n\n    ref ref | a (E)\n"
+                    "> Druga | Nowak\n\nZółć i woda | D [x2]\n", encoding="utf-8")
+    return str(path)
+
+
+def test_fold_strips_diacritics():
+    assert fold("Żółć ŁÓDŹ") == "zolc lodz"
+
+
+def test_song_chords_are_distinct_and_skip_comments():
+    song = Song.load_from_fasta("> One\n\na | C G (C)\nb | [x2] a\n")[0]
+    assert song_chords(song) == ["C", "G", "a"]
+
+
+def test_queries(tmp_path):
+    index = SearchIndex(build_index([write_songs(tmp_path)]))
+    assert [song["title"] for song in index.songs_with_words("ŁÓDŹ płynie")] == ["Żółta łódź"]
+    assert [song["title"] for song in index.songs_with_words("zolc")] == ["Druga"]
+    assert [song["title"] for song in index.songs_with_title("zolta")] == ["Żółta łódź"]
+    assert [song["title"] for song in index.songs_by_author("nowak")] == ["Druga"]
+    assert index.songs_with_words("nothing") == []
+
+
+def test_songs_playable_with_only_the_given_chords(tmp_path):
+    index = SearchIndex(build_index([write_songs(tmp_path)]))
+    assert [song["title"] for song in index.songs_playable_with(["C", "G", "a", "E", "D"])] == ["Druga", "Żółta łódź"]
+    assert [song["title"] for song in index.songs_playable_with(["D"])] == ["Druga"]
+    assert index.songs_playable_with(["C", "G"]) == []
+
+
+def test_entries_point_at_the_song_source(tmp_path):
+    path = write_songs(tmp_path)
+    data = open(path, "rb").read()
+    index = SearchIndex(build_index([path]))
+    for entry in index.songs:
+        text = data[entry["offset"]:entry["offset"] + entry["length"]].decode("utf-8")
+        assert text.startswith(f"> {entry['title']}")
+        assert data[:entry["offset"]].count(b"\n") + 1 == entry["line"]
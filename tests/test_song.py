@@ -0,0 +1,68 @@
+import pytest
+
+from song import FastaParseError, Song
+
+
+def parse(text):
+    return list(Song.iter_from_fasta(text, "test.fasta"))
+
+
+def test_songs_paragraphs_and_choruses():
+    songs = parse("> First | Author\n\nla la | C G\nli li\n\n    chorus | a\n> Second\n\nx | D\n")
+    assert [(song.title, song.author) for song in songs] == [("First", "Author"), ("Second", None)]
+    verse, chorus = songs[0].paragraphs
+    assert (verse.type, verse.lyrics_lines, verse.chords_lines) == ("verse", ["la la", "li li"], ["C G", ""])
+    assert (chorus.type, chorus.lyrics_lines, chorus.chords_lines) == ("chorus", ["chorus"], ["a"])
+
+
+def test_header_inside_a_song_starts_the_next_song():
+    songs = parse("> One\n\na | C\n> Two\nb | G\n")
+    assert [song.title for song in songs] == ["One", "Two"]
+    assert [song.paragraphs[0].lyrics for song in songs] == ["a", "b"]
+
+
+def test_several_empty_lines_are_one_paragraph_break():
+    songs = parse("> One\n\na\n\n\n\nb\n")
+    assert [paragraph.lyrics for paragraph in songs[0].paragraphs] == ["a", "b"]
+
+
+def test_comments_and_text_before_the_first_header_are_ignored():
+    songs = parse("intro\n# comment\n> One\n# comment\na | C\nb\n")
+    assert len(songs) == 1
+    assert songs[0].paragraphs[0].lyrics_lines == ["a", "b"]
+
+
+def test_page_break_directives():
+    songs = parse("> One\n\na\n\n#!break\nb\n\n#!nobreak\nc\n\nd\n")
+    assert [paragraph.page_break for paragraph in songs[0].paragraphs] == [None, True, False, None]
+    # Directives survive a round trip through the fasta text
+    assert [paragraph.page_break for paragraph in parse(repr(songs[0]))[0].paragraphs] == [None, True, False, None]
+
+
+def test_unknown_directives_are_comments():
+    songs = parse("> One\n\na\n#!!! not a directive\nb\n")
+    assert songs[0].paragraphs[0].lyrics_lines == ["a", "b"]
+
+
+def test_lines_are_read_lazily():
+    lines = iter(["> One\n", "a\n", "> Two\n", "b\n"])
+    songs = Song.iter_from_fasta(lines)
+    assert next(songs).title == "One"
+    # The second song is not complete until the input ends
+    assert next(lines) == "b\n"
+
+
+def test_second_separator_is_an_error():
+    with pytest.raises(FastaParseError) as error:
+        parse("> One\n\na | C\nb | C | G\n")
+    assert (error.value.line, error.value.column) == (4, 7)
+    assert str(error.value) == "test.fasta:4:7: unexpected second '|' separator"
+
+
+def test_source_spans_cover_the_songs():
+    text = "> One\n\nż | C\n\n> Two\n\nb\n"
+    data = text.encode()
+    songs = list(Song.iter_from_fasta(data.splitlines(keepends=True), "test.fasta"))
+    assert [(song.source.line, song.source.offset) for song in songs] == [(1, 0), (5, len("> One\n\nż | C\n\n".encode()))]
+    assert [data[song.source.offset:song.source.offset + song.source.length] for song in songs] == \
+        [b"> One\n\n\xc5\xbc | C\n\n", b"> Two\n\nb\n"]
@@ -0,0 +1,36 @@
+import os
+
+from song_loader import duplicate_titles, load_song_files, load_songs, resolve_patterns
+
+
+def write(path, text: str) -> str:
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_patterns_are_deduplicated(tmp_path):
+    a = write(tmp_path / "a.fasta", "> A\n\na\n")
+    b = write(tmp_path / "b.fasta", "> B\n\nb\n")
+    os.symlink(a, tmp_path / "link.fasta")
+    assert resolve_patterns([b, str(tmp_path / "*.fasta"), a]) == [b, a]
+
+
+def test_missing_files_and_directories_are_skipped(tmp_path):
+    (tmp_path / "dir.fasta").mkdir()
+    assert resolve_patterns([str(tmp_path / "missing.fasta"), str(tmp_path / "*.fasta")]) == []
+
+
+def test_result_does_not_depend_on_jobs(tmp_path):
+    for i in range(5):
+        write(tmp_path / f"{i}.fasta", f"> Song {i}a\n\nx | C\n> Song {i}b\n\ny | G\n")
+    pattern = [str(tmp_path / "*.fasta")]
+    serial = load_song_files(pattern)
+    parallel = load_song_files(pattern, jobs=2)
+    assert [(filename, [repr(song) for song in songs]) for filename, songs in serial] == \
+        [(filename, [repr(song) for song in songs]) for filename, songs in parallel]
+    assert [song.title for song in load_songs(pattern, jobs=2)] == [f"Song {i}{part}" for i in range(5) for part in "ab"]
+
+
+def test_duplicate_titles_ignore_case(tmp_path):
+    songs = load_songs([write(tmp_path / "a.fasta", "> Rejs\n\na\n> rejs \n\nb\n> Inna\n\nc\n")])
+    assert {title: len(same) for title, same in duplicate_titles(songs).items()} == {"Rejs": 2}
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from song_loader import parse_file, read_file
+from song_store import SongStore
+
+
+def manifest_entries(path: str):
+    # The same entries as build_song_index.py writes
+    return [{"title": song.title, "author": song.author, "file": path, "line": song.source.line,
+             "offset": song.source.offset, "length": song.source.length, "hash": song.content_hash()}
+            for song in parse_file(path, read_file(path))]
+
+
+@pytest.fixture
+def fasta(tmp_path):
+    path = tmp_path / "songs.fasta"
+    path.write_text("> Pierwsza\n\nżółw | C\n\n> Druga | Autor\n\nb | G\n\n    ref | a\n", encoding="utf-8")
+    return str(path)
+
+
+def test_song_by_title_parses_only_that_song(fasta):
+    full = {song.title: song for song in parse_file(fasta, read_file(fasta))}
+    store = SongStore(manifest_entries(fasta))
+    song = store.song_by_title("Druga")
+    store.close()
+    assert repr(song) == repr(full["Druga"])
+    assert (song.source.line, song.source.offset) == (full["Druga"].source.line, full["Druga"].source.offset)
+
+
+def test_unknown_title(fasta):
+    with pytest.raises(KeyError):
+        SongStore(manifest_entries(fasta)).song_by_title("Trzecia")
+
+
+def test_stale_manifest_is_reported(fasta):
+    entries = manifest_entries(fasta)
+    with open(fasta, "r+", encoding="utf-8") as file:
+        text = file.read()
+        file.seek(0)
+        file.write(text.replace("b | G", "x | G"))
+    store = SongStore(entries)
+    with pytest.raises(ValueError, match="changed since the manifest was built"):
+        store.song_by_title("Druga")
+    store.close()
+
+
+def test_load_rejects_a_manifest_without_offsets(tmp_path):
+    path = tmp_path / "song_manifest.json"
+    path.write_text(json.dumps({"paths": []}))
+    with pytest.raises(ValueError):
+        SongStore.load(str(path))
@@ -0,0 +1,38 @@
+from song import Song
+from transpose import invalid_chord_tokens, split_chord_token, transpose_chord_line, transpose_song, transpose_songs
+
+
+def test_split_chord_token():
+    assert split_chord_token("C") == ["", (0, True), ""]
+    assert split_chord_token("f#m7") == ["", (6, False), "m7"]
+    assert split_chord_token("(A#/D)") == ["(", (10, True), "/", (2, True), ")"]
+    # B is the Polish B flat, H is B
+    assert split_chord_token("Bb") == ["", (9, True), ""]
+    assert split_chord_token("H7") == ["", (11, True), "7"]
+
+
+def test_split_chord_token_rejects_non_chords():
+    assert split_chord_token("Xq") is None
+    assert split_chord_token("x2") is None
+    assert invalid_chord_tokens("C Xq [x2] G") == ["Xq"]
+
+
+def test_transpose_chord_line():
+    assert transpose_chord_line("C G a F", 2) == "D A h G"
+    assert transpose_chord_line("e7 H7/D# [x2]", -1) == "d#7 B7/D [x2]"
+    assert transpose_chord_line("C G a F", 12) == "C G a F"
+
+
+def test_transpose_song_keeps_lyrics_and_comments():
+    song = Song.load_from_fasta("> One\n\nla [ref] | C [x2]\n")[0]
+    transposed = transpose_song(song, 5)
+    assert transposed.paragraphs[0].lyrics == "la [ref]"
+    assert transposed.paragraphs[0].chords == "F [x2]"
+    assert transpose_song(transposed, -5).paragraphs[0].chords == "C [x2]"
+
+
+def test_transpose_songs_at_once():
+    songs = Song.load_from_fasta("> One\n\na | C G\n\nb | a\n> Two\n\nc | (E)\n")
+    transposed = transpose_songs(songs, 2)
+    assert [[paragraph.chords for paragraph in song.paragraphs] for song in transposed] == [["D A", "h"], ["(F#)"]]
+    assert transpose_songs(songs, 12) == songs
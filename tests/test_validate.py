@@ -0,0 +1,55 @@
+import json
+
+import validate
+from song_loader import parse_file
+
+
+def song(text: str):
+    return parse_file("test.fasta", text.encode())[0]
+
+
+def test_only_the_wide_paragraph_overflows():
+    issues = validate.song_issues(song("> T\n\nshort | C\n\n" + "x"*120 + " | G\n"))
+    assert [(issue["kind"], issue["paragraph"], issue["line"]) for issue in issues] == [("overflow", 2, None)]
+
+
+def test_chords_running_past_the_edge():
+    issues = validate.song_issues(song("> T\n\nshort | C\n\nshort | " + "C G a F "*6 + "\n"))
+    assert [(issue["kind"], issue["paragraph"], issue["line"]) for issue in issues] == [("overflow", 2, 1)]
+
+
+def test_bad_chord_names():
+    issues = validate.song_issues(song("> T\n\na | C\nb | G Xq [x2]\n"))
+    assert [(issue["kind"], issue["paragraph"], issue["line"]) for issue in issues] == [("chord", 1, 2)]
+    assert "'Xq'" in issues[0]["message"]
+
+
+def test_real_songs_fit():
+    for song in parse_file("songs/szanty.fasta", open("songs/szanty.fasta", "rb").read()):
+        assert validate.song_issues(song) == []
+
+
+def test_state_skips_unchanged_songs(tmp_path):
+    fasta = tmp_path / "a.fasta"
+    fasta.write_text("> One\n\na | C\n> Two\n\nb | Xq\n", encoding="utf-8")
+    state = str(tmp_path / "state.json")
+    first = validate.validate([str(fasta)], state)
+    assert [song["title"] for song in first["changed"]] == ["One", "Two"]
+    assert [issue["title"] for issue in first["issues"]] == ["Two"]
+
+    fasta.write_text("> One\n\na | D\n> Two\n\nb | Xq\n", encoding="utf-8")
+    second = validate.validate([str(fasta)], state)
+    assert [song["title"] for song in second["changed"]] == ["One"]
+    assert second["removed"] == 1
+    # Issues of the unchanged song come from the state
+    assert second["issues"] == first["issues"]
+    assert json.load(open(state))["version"] == validate.STATE_VERSION
+
+
+def test_parse_errors_are_reported(tmp_path):
+    fasta = tmp_path / "a.fasta"
+    fasta.write_bytes(b"> One\n\na | C | G\n")
+    bad = tmp_path / "b.fasta"
+    bad.write_bytes(b"> Two\n\n\xff\n")
+    report = validate.validate([str(fasta), str(bad)], None)
+    assert [(error["file"], error["line"]) for error in report["parse_errors"]] == [(str(fasta), 3), (str(bad), None)]